@@ -0,0 +1,11 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2026 NXP-flasher contributors
+#
+# Distributed under terms of the MIT license.
+
+"""
+Benchmarks, to be run from the repository root with ``python -m benchmarks.X``
+"""
@@ -0,0 +1,214 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2026 NXP-flasher contributors
+#
+# Distributed under terms of the MIT license.
+
+"""
+Micro-benchmarks of the host side hot paths on synthetic images.
+
+Each ``bench_*`` function receives the synthetic image and returns a
+callable doing the work to be timed, so that setup is kept out of the
+measurements, along with the number of bytes it processes.
+"""
+
+import argparse
+import binascii
+import io
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import timeit
+
+import ihex
+import nxpprog
+from image import FlashImage
+from nxpprog import NXPprog
+from programmers.abstract import AbstractProgrammer
+
+BASE_ADDR = 0x1a000000
+
+
+class NullProgrammer(AbstractProgrammer):
+    """Accepts everything, so that only the host encoding work is timed."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._reply = 'OK'
+
+    def write(self, data, **kwargs):
+        self._reply = '0' if data.startswith(b'W') else 'OK'
+        return len(data)
+
+    def readline(self, timeout=None, strip_end=True):
+        return self._reply
+
+
+class ReadbackProgrammer(NullProgrammer):
+    """Replies to R commands with the UU blocks of data, in order."""
+
+    def __init__(self, data, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.blocks = []
+        for i in range(0, len(data), NXPprog.UU_BLOCK_SIZE):
+            block = data[i:i + NXPprog.UU_BLOCK_SIZE]
+            lines = [binascii.b2a_uu(block[j:j + NXPprog.UU_LINE_SIZE])
+                    .decode().rstrip('\n')
+                    for j in range(0, len(block), NXPprog.UU_LINE_SIZE)]
+            lines.append(str(sum(block)))
+            self.blocks.append(lines)
+        self.rewind()
+
+    def rewind(self):
+        self._blocks = iter(self.blocks)
+
+    def write(self, data, **kwargs):
+        self._reply = '0' if data[:1] in (b'W', b'R') else 'OK'
+        return len(data)
+
+    def readlines(self, count, timeout=None, strip_end=True, size=0):
+        return list(next(self._blocks))
+
+
+def make_ihex(data, base_addr, record_size=16):
+    """Return an Intel hex file holding data at base_addr."""
+    lines = []
+    upper = None
+    for offset in range(0, len(data), record_size):
+        addr = base_addr + offset
+        if addr >> 16 != upper:
+            upper = addr >> 16
+            lines.append(ihex_record(0, ihex.ihex.TYPE_EXTENDED_LINEAR_ADDR,
+                upper.to_bytes(2, 'big')))
+        lines.append(ihex_record(addr & 0xffff, ihex.ihex.TYPE_DATA,
+            data[offset:offset + record_size]))
+    lines.append(ihex_record(0, ihex.ihex.TYPE_EOF, b''))
+    return '\n'.join(lines) + '\n'
+
+
+def ihex_record(addr, rtype, payload):
+    record = bytes((len(payload), addr >> 8, addr & 0xff, rtype)) + payload
+    csum = (-sum(record)) & 0xff
+    return ':' + (record + bytes((csum, ))).hex().upper()
+
+
+def programmer():
+    prog = NXPprog(device=None, cpu='lpc1857')
+    prog.programmer = NullProgrammer()
+    prog.echo_on = 0
+    return prog
+
+
+def bench_ihex_parse(image):
+    text = make_ihex(image, BASE_ADDR)
+    return lambda: ihex.ihex(fd=io.StringIO(text)), len(image)
+
+
+def bench_ihex_line_parse(image):
+    line = make_ihex(image[:16], BASE_ADDR).splitlines()[1][1:]
+    parser = ihex.ihex(fd=io.StringIO(''))
+    count = len(image) // 16
+
+    def run():
+        for i in range(count):
+            parser.line_parse(line, i)
+    return run, count * 16
+
+
+def bench_ihex_flatten(image):
+    parser = ihex.ihex(fd=io.StringIO(make_ihex(image, BASE_ADDR)))
+    return parser.flatten, len(image)
+
+
+def bench_sum(image):
+    prog = programmer()
+    return lambda: prog.sum(image), len(image)
+
+
+def bench_insert_csum(image):
+    prog = programmer()
+    flash_image = FlashImage(image)
+    return lambda: prog.insert_csum(flash_image), len(image)
+
+
+def bench_bytestr_padding(image):
+    # worst case padding of the last RAM block
+    prog = programmer()
+    count = NXPprog.FLASH_BUFFER_SIZE_DEFAULT - 1
+    return lambda: prog.bytestr(0xff, count), count
+
+
+def bench_write_ram_data(image):
+    prog = programmer()
+    return lambda: prog.write_ram_data(0x10081000, image), len(image)
+
+
+def bench_read_block(image):
+    prog = programmer()
+    prog.programmer = ReadbackProgrammer(image)
+
+    def run():
+        prog.programmer.rewind()
+        prog.read_block(0x10081000, len(image))
+    return run, len(image)
+
+
+BENCHMARKS = [(name[len('bench_'):], func)
+        for name, func in sorted(globals().items())
+        if name.startswith('bench_')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Host side micro-benchmarks')
+    parser.add_argument('--size', '-s', type=lambda x: int(x, 0),
+            default=2 * 1024 * 1024,
+            help='Synthetic image size in bytes (default: 2MB)')
+    parser.add_argument('--repeat', '-r', type=int, default=3,
+            help='Number of timed runs, the best one is reported')
+    parser.add_argument('-k', dest='keyword', default='',
+            help='Only run benchmarks whose name contains this string')
+    parser.add_argument('--output', '-o',
+            help='JSON file receiving the results')
+    args = parser.parse_args(argv)
+
+    nxpprog.logger.setLevel(logging.WARNING)
+
+    image = random.Random(0).randbytes(args.size)
+
+    results = {}
+    for name, bench in BENCHMARKS:
+        if args.keyword not in name:
+            continue
+        func, nbytes = bench(image)
+        timings = timeit.Timer(func).repeat(repeat=args.repeat, number=1)
+        best = min(timings)
+        results[name] = {
+                'best': best,
+                'mean': sum(timings) / len(timings),
+                'bytes': nbytes,
+                'bps': nbytes / best if best else None,
+                }
+        print('{:<20} {:>10.4f} s  {:>12.0f} B/s'.format(name, best,
+            results[name]['bps'] or 0))
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'size': args.size,
+                'results': results,
+                }, fd, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2026 NXP-flasher contributors
+#
+# Distributed under terms of the MIT license.
+
+"""
+End-to-end flashing throughput against the simulated ISP target.
+
+Every run programs an image with NXPprog into a target holding old data,
+then reads it back, and reports bytes/s on the wire (simulated link time)
+and on the host (time spent in NXPprog itself), along with the wire time of
+each phase. Programming is timed from the connection to the target on.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import sys
+import time
+
+import nxpprog
+from nxpchips import NXPchip
+from nxpprog import NXPprog
+
+SIZES = (4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, None)
+BAUDRATES = (9600, 115200, 230400)
+
+# simulator time buckets reported for each phase
+PHASES = {
+        'sync': ('sync', ),
+        'erase': ('I', 'E', ),
+        'upload': ('W', ),
+        'copy': ('C', ),
+        'read': ('R', ),
+        }
+
+
+class Stopwatch(object):
+    """Measures a run, splitting host and simulated target time.
+
+    The target is looked up through the programmer of `prog`, a run started
+    before the connection counts the target from power up.
+    """
+
+    def __init__(self, prog):
+        self.prog = prog
+
+    def __enter__(self):
+        if self.prog.programmer:
+            stats = self.prog.programmer.target.stats
+            self._cpu_time = stats['cpu_time']
+            self._time = dict(stats['time'])
+            self._bytes = stats['bytes_in'] + stats['bytes_out']
+        else:
+            self._cpu_time = 0.0
+            self._time = {}
+            self._bytes = 0
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._started
+        stats = self.prog.programmer.target.stats
+        self.host_time = elapsed - (stats['cpu_time'] - self._cpu_time)
+        self.wire_bytes = stats['bytes_in'] + stats['bytes_out'] - self._bytes
+        self.phases = {}
+        for phase, buckets in PHASES.items():
+            spent = sum(stats['time'].get(b, 0) - self._time.get(b, 0)
+                    for b in buckets)
+            if spent:
+                self.phases[phase] = spent
+        self.wire_time = sum(stats['time'].values()) - sum(self._time.values())
+
+    def report(self, size):
+        return {
+                'wire_time': self.wire_time,
+                'host_time': self.host_time,
+                'wire_bytes': self.wire_bytes,
+                'wire_bps': size / self.wire_time if self.wire_time else None,
+                'host_bps': size / self.host_time if self.host_time else None,
+                'phases': self.phases,
+                }
+
+
+def run(cpu_name, baudrate, size, seed=0):
+    # flash holding an older image, so that sectors are blank checked and
+    # erased as on a used part
+    prog = NXPprog(device=cpu_name + ',fill=0', cpu=cpu_name,
+            baudrate=baudrate, programmer='simulator')
+
+    bank_size = prog.cpu.flash_bank_size
+    if size is None:
+        size = bank_size
+    if size > bank_size:
+        return None
+
+    rnd = random.Random(seed)
+    image = rnd.randbytes(size)
+    addr = prog.cpu.flash_banks[0]
+
+    result = {
+            'cpu': cpu_name,
+            'baudrate': baudrate,
+            'size': size,
+            }
+
+    with Stopwatch(prog) as prog_watch:
+        prog.init_programmer()
+        prog.prog_image(image, addr)
+    result['prog'] = prog_watch.report(size)
+
+    with Stopwatch(prog) as read_watch:
+        data = prog.read_block(addr, size)
+    result['read'] = read_watch.report(size)
+
+    if data[32:] != image[32:]:
+        result['error'] = 'readback mismatch'
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Flashing throughput benchmark on a simulated target')
+    parser.add_argument('--cpu', '-c', action='append',
+            choices=sorted(NXPchip.CPUS.keys()),
+            help='Chip to benchmark (default: all)')
+    parser.add_argument('--baudrate', '-b', action='append', type=int,
+            choices=NXPprog.BAUDRATES,
+            help='Baudrate (default: {})'.format(
+                ', '.join(str(b) for b in BAUDRATES)))
+    parser.add_argument('--size', '-s', action='append', type=lambda x: int(x, 0),
+            help='Image size in bytes (default: 4KB to full flash)')
+    parser.add_argument('--output', '-o', default='throughput.json',
+            help='JSON file receiving the results')
+    args = parser.parse_args(argv)
+
+    nxpprog.logger.setLevel(logging.WARNING)
+
+    cpus = args.cpu or sorted(NXPchip.CPUS.keys())
+    baudrates = args.baudrate or BAUDRATES
+    sizes = args.size or SIZES
+
+    results = []
+    for cpu_name in cpus:
+        for baudrate in baudrates:
+            for size in sizes:
+                try:
+                    result = run(cpu_name, baudrate, size)
+                except SystemExit:
+                    result = {'cpu': cpu_name, 'baudrate': baudrate,
+                            'size': size, 'error': 'flasher exited'}
+                if result is None:
+                    continue
+                results.append(result)
+
+                if 'error' in result:
+                    print('{:<8} {:>6} {:>8}  {}'.format(cpu_name, baudrate,
+                        result['size'], result['error']))
+                    continue
+                print('{:<8} {:>6} {:>8}  prog {:>8.0f} B/s wire {:>10.0f} B/s host'
+                        '  read {:>8.0f} B/s wire {:>10.0f} B/s host'.format(
+                            cpu_name, baudrate, result['size'],
+                            result['prog']['wire_bps'], result['prog']['host_bps'],
+                            result['read']['wire_bps'], result['read']['host_bps']))
+
+    with open(args.output, 'w') as fd:
+        json.dump({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results,
+            }, fd, indent=2, sort_keys=True)
+
+    return 0 if all('error' not in r for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2026 NXP-flasher contributors
+#
+# Distributed under terms of the MIT license.
+
+"""
+Loads the PT_LOAD segments of an ELF file at their physical address
+"""
+
+import mmap
+import struct
+
+from image import FlashImage
+
+
+class ElfError(Exception):
+    pass
+
+
+PT_LOAD = 1
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+# ELF header (after e_ident) and program header layouts
+HEADERS = {
+        ELFCLASS32: ('HHIIIIIHHH', ('p_type', 'p_offset', 'p_vaddr',
+            'p_paddr', 'p_filesz', 'p_memsz'), 'IIIIII'),
+        ELFCLASS64: ('HHIQQQIHHH', ('p_type', 'p_flags', 'p_offset',
+            'p_vaddr', 'p_paddr', 'p_filesz', 'p_memsz'), 'IIQQQQQ'),
+        }
+
+
+def load(filename):
+    """
+    Return a FlashImage holding the PT_LOAD segments of an ELF file.
+
+    The file is mapped copy-on-write: segments are views into the mapping,
+    and patching the checksum vector only copies the page it lives in.
+    """
+    with open(filename, 'rb') as fd:
+        try:
+            mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_COPY)
+        except ValueError:
+            raise ElfError('{}: empty file'.format(filename)) from None
+
+    view = memoryview(mapped)
+    if len(view) < 16 or view[:4] != b'\x7fELF':
+        raise ElfError('{}: not an ELF file'.format(filename))
+
+    elf_class, elf_data = view[4], view[5]
+    if elf_class not in HEADERS:
+        raise ElfError('{}: unknown ELF class {}'.format(filename, elf_class))
+    if elf_data == ELFDATA2LSB:
+        endian = '<'
+    elif elf_data == ELFDATA2MSB:
+        endian = '>'
+    else:
+        raise ElfError('{}: unknown ELF data encoding {}'.format(filename,
+            elf_data))
+
+    ehdr_fmt, phdr_fields, phdr_fmt = HEADERS[elf_class]
+    try:
+        ehdr = struct.unpack_from(endian + ehdr_fmt, view, 16)
+        phoff, phentsize, phnum = ehdr[4], ehdr[8], ehdr[9]
+    except struct.error:
+        raise ElfError('{}: truncated ELF header'.format(filename)) from None
+
+    image = FlashImage()
+    for index in range(phnum):
+        try:
+            phdr = dict(zip(phdr_fields, struct.unpack_from(endian + phdr_fmt,
+                view, phoff + index * phentsize)))
+        except struct.error:
+            raise ElfError('{}: truncated program header {}'.format(filename,
+                index)) from None
+
+        if phdr['p_type'] != PT_LOAD or not phdr['p_filesz']:
+            continue
+
+        start = phdr['p_offset']
+        end = start + phdr['p_filesz']
+        if end > len(view):
+            raise ElfError('{}: segment {} is truncated'.format(filename,
+                index))
+        try:
+            image.add_segment(phdr['p_paddr'], view[start:end])
+        except ValueError as e:
+            raise ElfError('{}: {}'.format(filename, e)) from None
+
+    if not image.segments:
+        raise ElfError('{}: no loadable segment'.format(filename))
+
+    return image
@@ -2,9 +2,12 @@
 import sys
 import string
 
+class IhexError(Exception):
+    pass
+
 class data_rec:
     def __init__(self, addr, data):
-        if type(data) != type(b""):
+        if not isinstance(data, (bytes, bytearray)):
             raise Exception("data is not a binary string")
         self.addr = addr
         self.data = data
@@ -21,102 +24,110 @@ class ihex:
     TYPE_START_LINEAR_ADDR = 5
 
     def __init__(self, fn=None, fd=None):
-        if fn:
-            fd = open(fn, "r")
-        else:
-            fd = fd
-
+        # records are merged into contiguous segments while parsing, so
+        # self.data holds one data_rec per segment instead of one per line
         self.data = []
 
         self.start_addr = None
 
+        if fn:
+            # file objects are read in chunks, one line at a time
+            with open(fn, "r") as fd:
+                self.parse(fd)
+        else:
+            self.parse(fd)
+
+    def parse(self, lines):
         base_addr = 0
+        seg_addr = None
+        seg_data = None
 
         line_no = 0
-        for line in fd:
-            l = line.strip()
+        for line in lines:
             line_no += 1
+            if isinstance(line, (bytes, bytearray)):
+                line = line.decode()
+            l = line.strip()
+            if not l:
+                continue
             if l[0] != ":":
-                raise Exception("invalid initial character '%s' line %d",
+                raise IhexError("invalid initial character %r: line %d" %
                         (l[0], line_no))
-            if len(l[1:]) % 2 != 0:
-                raise Exception("line length not a multiple of two: line %d" %
-                            line_no)
-
-            (l, addr, type, data) = self.line_parse(l[1:], line_no)
 
-            if l != len(data):
-                print("data length does not match length field %d" % line_no)
+            (length, addr, type, data) = self.line_parse(l[1:], line_no)
 
-            if type == self.TYPE_EOF:
-                return
-
-            if type == self.TYPE_EXTENDED_SEGMENT_ADDR:
+            if type == self.TYPE_DATA:
+                addr += base_addr
+                if seg_data is not None and addr == seg_addr + len(seg_data):
+                    seg_data += data
+                else:
+                    if seg_data is not None:
+                        self.data.append(data_rec(seg_addr, seg_data))
+                    seg_addr, seg_data = addr, bytearray(data)
+
+            elif type == self.TYPE_EOF:
+                break
+
+            elif type == self.TYPE_EXTENDED_SEGMENT_ADDR:
                 base_addr = 0x10 * self.multi_val(data)
 
-            if type == self.TYPE_EXTENDED_LINEAR_ADDR:
+            elif type == self.TYPE_EXTENDED_LINEAR_ADDR:
                 base_addr = 0x10000 * self.multi_val(data)
 
-            if type == self.TYPE_START_SEGMENT_ADDR or \
+            elif type == self.TYPE_START_SEGMENT_ADDR or \
                 type == self.TYPE_START_LINEAR_ADDR:
                 if self.start_addr:
                     print("start address set twice: line %d" % line_no)
                 self.start_addr = self.multi_val(data)
 
-            if type == self.TYPE_DATA:
-                self.data.append(data_rec(addr + base_addr,
-                        self.intlist_tostr(data)))
+        if seg_data is not None:
+            self.data.append(data_rec(seg_addr, seg_data))
 
     def line_parse(self, hexstring, line_no):
-        list = []
-        cksum = 0
-        for i in range(0, len(hexstring), 2):
-            val = int(hexstring[i:i+2], 16)
-            list.append(val)
-            cksum += val
-
-        cksum %= 0x100
-        if cksum != 0:
-            raise Exception("invalid checksum: line %d" % line_no)
-
-        return (list[0], self.multi_val(list[1:3]), list[3], list[4:-1])
+        try:
+            rec = bytes.fromhex(hexstring)
+        except ValueError:
+            raise IhexError("invalid hex digits or odd length: line %d" %
+                    line_no) from None
+
+        if len(rec) < 5:
+            raise IhexError("record too short: line %d" % line_no)
+        if sum(rec) & 0xff:
+            raise IhexError("invalid checksum: line %d" % line_no)
+        if rec[0] != len(rec) - 5:
+            raise IhexError("data length does not match length field: line %d" %
+                    line_no)
+
+        return (rec[0], (rec[1] << 8) | rec[2], rec[3],
+                memoryview(rec)[4:-1])
 
     def intlist_tostr(self, list):
         return bytes(list)
 
     def multi_val(self, data):
-        sum = 0
-        for val in data:
-            sum = sum * 0x100 + val
-        return sum
+        return int.from_bytes(data, 'big')
 
     def dump(self):
         for d in self.data:
             print(d)
 
     def padding(self, fill, len):
-        s = b''
-        for i in range(0, len):
-            s += bytes([fill])
-        return s
+        return bytes((fill, )) * len
 
     def flatten(self, fill = 0xff):
         sort_list = []
         for d in self.data:
             sort_list.append((d.addr, d.data))
         sort_list.sort(key=lambda x: x[0])
-        data = b''
-        last_addr = sort_list[0][0]
-        start_addr = last_addr
+        start_addr = sort_list[0][0]
+        last_addr = start_addr
         for e in sort_list:
-            addr = e[0]
-            l = len(e[1])
-            pad = addr - last_addr
-            if pad < 0:
-                raise Exception("overlapping sections in file")
-            if pad > 0:
-                data += self.padding(fill, pad)
-                l += pad
-            data += e[1]
-            last_addr += l
+            if e[0] < last_addr:
+                raise IhexError("overlapping sections in file")
+            last_addr = e[0] + len(e[1])
+
+        # allocate the whole image once, gaps are already filled
+        data = bytearray((fill, )) * (last_addr - start_addr)
+        for addr, rec in sort_list:
+            data[addr - start_addr:addr - start_addr + len(rec)] = rec
         return (start_addr, data)
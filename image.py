@@ -0,0 +1,144 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2026 NXP-flasher contributors
+#
+# Distributed under terms of the MIT license.
+
+"""
+Holds images to be programmed into flash
+"""
+
+import bisect
+import os
+import struct
+
+
+class FlashImage(object):
+    """
+    Sparse image: a sorted list of non overlapping (address, buffer) segments.
+
+    Gaps between segments are never materialised. The checksum vector is
+    patched in place and blocks are handed out as views into the segments;
+    only blocks straddling a segment boundary are copied into a padded
+    buffer.
+    """
+
+    # for calculations in 32 bit modulo arithmetic
+    U32_MOD = (2 ** 32)
+
+    def __init__(self, data=None, base_addr=0):
+        self._starts = []
+        self.segments = []
+        if data is not None:
+            self.add_segment(base_addr, data)
+
+    @classmethod
+    def from_file(cls, filename, base_addr=0):
+        data = bytearray(os.path.getsize(filename))
+        with open(filename, 'rb') as fd:
+            fd.readinto(data)
+        return cls(data, base_addr)
+
+    @classmethod
+    def from_segments(cls, segments):
+        image = cls()
+        for addr, data in segments:
+            image.add_segment(addr, data)
+        return image
+
+    def add_segment(self, addr, data):
+        if not isinstance(data, (bytearray, memoryview)):
+            data = bytearray(data)
+        if not len(data):
+            return
+
+        index = bisect.bisect_right(self._starts, addr)
+        if index and self.segments[index - 1][0] + \
+                len(self.segments[index - 1][1]) > addr:
+            raise ValueError('Segment at 0x%x overlaps previous segment' % addr)
+        if index < len(self._starts) and addr + len(data) > self._starts[index]:
+            raise ValueError('Segment at 0x%x overlaps next segment' % addr)
+
+        self._starts.insert(index, addr)
+        self.segments.insert(index, (addr, data))
+
+    def __len__(self):
+        return sum(len(data) for addr, data in self.segments)
+
+    @property
+    def base_addr(self):
+        return self._starts[0] if self._starts else 0
+
+    @property
+    def end_addr(self):
+        if not self.segments:
+            return 0
+        addr, data = self.segments[-1]
+        return addr + len(data)
+
+    def find_segment(self, addr, size=1):
+        """Return (segment data, offset) of a range held by one segment."""
+        index = bisect.bisect_right(self._starts, addr) - 1
+        if index < 0:
+            return None
+        start, data = self.segments[index]
+        if addr + size > start + len(data):
+            return None
+        return data, addr - start
+
+    def insert_csum(self, csum_vec, addr=None):
+        """Make the image bootable by inserting the vector table checksum."""
+        if addr is None:
+            addr = self.base_addr
+        found = self.find_segment(addr, 32)
+        if found is None:
+            raise ValueError('No vector table at 0x%x' % addr)
+        data, offset = found
+
+        intvecs = struct.unpack_from('<8I', data, offset)
+        csum = sum(intvecs) - intvecs[csum_vec]
+        csum = (self.U32_MOD - csum % self.U32_MOD) % self.U32_MOD
+        struct.pack_into('<I', data, offset + csum_vec * 4, csum)
+        return csum
+
+    def extents(self, align=1):
+        """Return the sorted (start, end) ranges holding data, aligned."""
+        extents = []
+        for addr, data in self.segments:
+            start = addr - addr % align
+            end = -(-(addr + len(data)) // align) * align
+            if extents and start <= extents[-1][1]:
+                extents[-1][1] = max(extents[-1][1], end)
+            else:
+                extents.append([start, end])
+        return [tuple(e) for e in extents]
+
+    def padded_size(self, block_size):
+        return sum(end - start for start, end in self.extents(block_size))
+
+    def read(self, addr, size, fill=0xff):
+        """Return size bytes at addr, filling the gaps between segments."""
+        found = self.find_segment(addr, size)
+        if found is not None:
+            data, offset = found
+            return memoryview(data)[offset:offset + size]
+
+        block = bytearray((fill, )) * size
+        index = max(bisect.bisect_right(self._starts, addr) - 1, 0)
+        for start, data in self.segments[index:]:
+            if start >= addr + size:
+                break
+            lo = max(start, addr)
+            hi = min(start + len(data), addr + size)
+            if lo < hi:
+                block[lo - addr:hi - addr] = \
+                        memoryview(data)[lo - start:hi - start]
+        return memoryview(block)
+
+    def blocks(self, block_size, fill=0xff):
+        """Yield (address, data) for each aligned block holding data."""
+        for start, end in self.extents(block_size):
+            for addr in range(start, end, block_size):
+                yield addr, self.read(addr, block_size, fill)
@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2026 NXP-flasher contributors
+#
+# Distributed under terms of the MIT license.
+
+"""
+Sidecar journals of the ranges completed by long transfers
+"""
+
+import os
+
+
+class RangeJournal(object):
+    """
+    Append only record of the completed [start, end) ranges of a transfer.
+
+    The first line identifies the transfer and each following line holds a
+    completed range, so that a transfer interrupted at any point, even
+    while a line is being written, is resumed from the ranges recorded.
+    A journal written for another transfer is started over.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.ranges = []
+        self._fd = None
+
+    def load(self):
+        """Read the ranges recorded for this transfer, True if any."""
+        self.ranges = []
+        try:
+            with open(self.path, 'r') as fd:
+                if fd.readline().rstrip('\n') != self.header:
+                    return False
+                for line in fd:
+                    fields = line.split()
+                    # a line cut short by the interruption is left out
+                    if not line.endswith('\n') or len(fields) != 2:
+                        break
+                    self._merge(int(fields[0], 0), int(fields[1], 0))
+        except FileNotFoundError:
+            return False
+        return bool(self.ranges)
+
+    def open(self):
+        if self.ranges:
+            self._fd = open(self.path, 'a')
+        else:
+            self._fd = open(self.path, 'w')
+            self._fd.write(self.header + '\n')
+            self._fd.flush()
+
+    def close(self):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def remove(self):
+        self.close()
+        self.ranges = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def add(self, start, end):
+        if start >= end:
+            return
+        self._merge(start, end)
+        self._fd.write('0x%x 0x%x\n' % (start, end))
+        self._fd.flush()
+
+    def _merge(self, start, end):
+        ranges = []
+        for s, e in self.ranges:
+            if e < start or s > end:
+                ranges.append((s, e))
+            else:
+                start, end = min(s, start), max(e, end)
+        ranges.append((start, end))
+        self.ranges = sorted(ranges)
+
+    def done(self, start, end):
+        """True if [start, end) is fully recorded."""
+        return any(s <= start and end <= e for s, e in self.ranges)
+
+    def missing(self, start, end):
+        """Return the [start, end) ranges not recorded yet, sorted."""
+        gaps = []
+        for s, e in self.ranges:
+            if e <= start:
+                continue
+            if s >= end:
+                break
+            if s > start:
+                gaps.append((start, s))
+            start = max(start, e)
+        if start < end:
+            gaps.append((start, end))
+        return gaps
@@ -10,292 +10,171 @@
 Holds NXP chips parameters
 """
 
-class NXPchip(object):
-    FLASH_SECTORS = {
-            'lpc23xx': (                # lpc23xx/lpc24xx/lpc214x processors
-                4,  4,  4,  4,  4,  4,  4,  4,
-                32, 32, 32, 32, 32, 32, 32,
-                32, 32, 32, 32, 32, 32, 32,
-                4,  4,  4,  4,  4,  4
-                ),
-            'lpc21xx_64': (             # 64k lpc21xx processors (without bootsector)
-                8,  8,  8,  8,  8,  8,  8,  8
-                ),
-            'lpc21xx_128': (            # 128k lpc21xx processors (without bootsector)
-                8,  8,  8,  8,  8,  8,  8,  8,
-                8,  8,  8,  8,  8,  8,  8
-                ),
-            'lpc21xx_256': (            # 256k lpc21xx processors (without bootsector)
-                8,  8,  8,  8,  8,  8,  8,  8,
-                64, 64,
-                8,  8,  8,  8,  8,  8,  8,
-                ),
-            'lpc17xx': (                # lpc17xx processors
-                4,  4,  4,  4,  4,  4,  4,  4,
-                4,  4,  4,  4,  4,  4,  4,  4,
-                32, 32, 32, 32, 32, 32, 32,
-                32, 32, 32, 32, 32, 32, 32,
-                ),
-            'lpc11xx': (                # lpc11xx processors
-                4,  4,  4,  4,  4,  4,  4,  4,
-                ),
-            'lpc18xx': (                # lpc18xx processors
-                8,  8,  8,  8,  8,  8,  8,  8,
-                64, 64, 64, 64, 64, 64, 64,
-                ),
+import bisect
+import configparser
+import os
+import sys
+from collections import namedtuple
+
+
+FlashSector = namedtuple('FlashSector', ('bank', 'sector', 'start', 'size'))
+RamBuffer = namedtuple('RamBuffer', ('base', 'block_size', 'size'))
+# everything derived from the parameters of a chip, computed once at load
+ChipLayout = namedtuple('ChipLayout', ('banks', 'sectors', 'starts',
+    'flash_size', 'ram_buffer'))
+
+
+def _ints(value):
+    return tuple(int(v, 0) for v in value.split())
+
+
+def _devid(value):
+    words = _ints(value)
+    return words if len(words) > 1 else words[0]
+
+
+def _bool(value):
+    if value.lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+        raise ValueError('Not a boolean: {}'.format(value))
+    return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+
+
+class ChipDatabase(object):
+    """
+    Chip parameters read from nxpchips.ini, indexed by name and device id.
+    """
+
+    FILENAME = 'nxpchips.ini'
+    SECTORS_PREFIX = 'sectors:'
+
+    FLASH_BUFFER_BASE_DEFAULT = 0x40001000
+    FLASH_BUFFER_SIZE_DEFAULT = 4096
+
+    # parser of each chip parameter, flash_sector is resolved separately
+    PARAMETERS = {
+            'flash_sector': str,
+            'flash_sector_count': lambda v: int(v, 0),
+            'flash_bank_addr': _ints,
+            'flash_prog_buffer_base': lambda v: int(v, 0),
+            'flash_prog_buffer_size': lambda v: int(v, 0),
+            'flash_prog_ram_size': lambda v: int(v, 0),
+            'devid': _devid,
+            'csum_vec': lambda v: int(v, 0),
+            'cpu_type': str,
+            'isp_binary': _bool,
             }
 
-    CPUS = {
-            # 128k flash
-            "lpc2364" : {
-                "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                "flash_sector_count": 11,
-                "devid": 369162498
-                },
-            # 256k flash
-            "lpc2365" : {
-                "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                "flash_sector_count": 15,
-                "devid": 369158179
-                },
-            "lpc2366" : {
-                "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                "flash_sector_count": 15,
-                "devid": 369162531
-                },
-            # 512k flash
-            "lpc2367" : {
-                "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                "devid": 369158181
-                },
-            "lpc2368" : {
-                "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                "devid": 369162533
-                },
-            "lpc2377" : {
-                "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                "devid": 385935397
-                },
-            "lpc2378" : {
-                "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                "devid": 385940773
-                },
-            "lpc2387" : {
-                "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                "devid": 402716981
-
-                },
-            "lpc2388" : {
-                "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                "devid": 402718517
-                },
-            # lpc21xx
-            # some incomplete info here need at least sector count
-            "lpc2141": {
-                "devid": 196353,
-                "flash_sector": FLASH_SECTORS['lpc23xx'],
-                "flash_sector_count": 8,
-                },
-            "lpc2142": {
-                    "flash_sector": FLASH_SECTORS['lpc23xx'],
-                    "flash_sector_count": 9,
-                    "devid": 196369,
-                    },
-            "lpc2144": {
-                    "flash_sector": FLASH_SECTORS['lpc23xx'],
-                    "flash_sector_count": 11,
-                    "devid": 196370,
-                    },
-            "lpc2146": {
-                    "flash_sector": FLASH_SECTORS['lpc23xx'],
-                    "flash_sector_count": 15,
-                    "devid": 196387,
-                    },
-            "lpc2148": {
-                    "flash_sector": FLASH_SECTORS['lpc23xx'],
-                    "flash_sector_count": 27,
-                    "devid": 196389,
-                    },
-            "lpc2109" : {
-                    "flash_sector": FLASH_SECTORS['lpc21xx_64'],
-                    "devid": 33685249
-                    },
-            "lpc2119" : {
-                    "flash_sector": FLASH_SECTORS['lpc21xx_128'],
-                    "devid": 33685266
-                    },
-            "lpc2129" : {
-                    "flash_sector": FLASH_SECTORS['lpc21xx_256'],
-                    "devid": 33685267
-                    },
-            "lpc2114" : {
-                    "flash_sector" : FLASH_SECTORS['lpc21xx_128'],
-                    "devid": 16908050
-                    },
-            "lpc2124" : {
-                    "flash_sector" : FLASH_SECTORS['lpc21xx_256'],
-                    "devid": 16908051
-                    },
-            "lpc2194" : {
-                    "flash_sector" : FLASH_SECTORS['lpc21xx_256'],
-                    "devid": 50462483
-                    },
-            "lpc2292" : {
-                    "flash_sector" : FLASH_SECTORS['lpc21xx_256'],
-                    "devid": 67239699
-                    },
-            "lpc2294" : {
-                    "flash_sector" : FLASH_SECTORS['lpc21xx_256'],
-                    "devid": 84016915
-                    },
-            # lpc22xx
-            "lpc2212" : {
-                    "flash_sector" : FLASH_SECTORS['lpc21xx_128']
-                    },
-            "lpc2214" : {
-                    "flash_sector" : FLASH_SECTORS['lpc21xx_256']
-                    },
-            # lpc24xx
-            "lpc2458" : {
-                    "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                    "devid": 352386869,
-                    },
-            "lpc2468" : {
-                    "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                    "devid": 369164085,
-                    },
-            "lpc2478" : {
-                    "flash_sector" : FLASH_SECTORS['lpc23xx'],
-                    "devid": 386006837,
-                    },
-            # lpc17xx
-            "lpc1768" : {
-                    "flash_sector" : FLASH_SECTORS['lpc17xx'],
-                    "flash_prog_buffer_base" : 0x10001000,
-                    "csum_vec": 7,
-                    "devid": 0x26013f37,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1766" : {
-                    "flash_sector" : FLASH_SECTORS['lpc17xx'],
-                    "flash_prog_buffer_base" : 0x10001000,
-                    "csum_vec": 7,
-                    "devid": 0x26013f33,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1765" : {
-                    "flash_sector" : FLASH_SECTORS['lpc17xx'],
-                    "flash_prog_buffer_base" : 0x10001000,
-                    "csum_vec": 7,
-                    "devid": 0x26013733,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1764" : {
-                    "flash_sector" : FLASH_SECTORS['lpc17xx'],
-                    "flash_prog_buffer_base" : 0x10001000,
-                    "csum_vec": 7,
-                    "devid": 0x26011922,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1758" : {
-                    "flash_sector" : FLASH_SECTORS['lpc17xx'],
-                    "flash_prog_buffer_base" : 0x10001000,
-                    "csum_vec": 7,
-                    "devid": 0x26013f34,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1756" : {
-                    "flash_sector" : FLASH_SECTORS['lpc17xx'],
-                    "flash_prog_buffer_base" : 0x10001000,
-                    "csum_vec": 7,
-                    "devid": 0x26011723,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1754" : {
-                    "flash_sector" : FLASH_SECTORS['lpc17xx'],
-                    "flash_prog_buffer_base" : 0x10001000,
-                    "csum_vec": 7,
-                    "devid": 0x26011722,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1752" : {
-                    "flash_sector" : FLASH_SECTORS['lpc17xx'],
-                    "flash_prog_buffer_base" : 0x10001000,
-                    "csum_vec": 7,
-                    "devid": 0x26001121,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1751" : {
-                    "flash_sector" : FLASH_SECTORS['lpc17xx'],
-                    "flash_prog_buffer_base" : 0x10001000,
-                    "csum_vec": 7,
-                    "devid": 0x26001110,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1114" : {
-                    "flash_sector" : FLASH_SECTORS['lpc11xx'],
-                    "flash_prog_buffer_base" : 0x10000400,
-                    "devid": 0x0444102B,
-                    "flash_prog_buffer_size" : 1024
-                    },
-            # lpc18xx
-            "lpc1817" : {
-                    "flash_sector" : FLASH_SECTORS['lpc18xx'],
-                    "flash_bank_addr": (0x1a000000, 0x1b000000),
-                    "flash_prog_buffer_base" : 0x10081000,
-                    "devid": (0xF001DB3F, 0),
-                    "csum_vec": 7,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1832" : {
-                    "flash_sector" : FLASH_SECTORS['lpc18xx'],
-                    "flash_bank_addr": (0x1a000000),
-                    "flash_prog_buffer_base" : 0x10081000,
-                    "csum_vec": 7,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1833" : {
-                    "flash_sector" : FLASH_SECTORS['lpc18xx'],
-                    "flash_sector_count": 11,
-                    "flash_bank_addr": (0x1a000000, 0x1b000000),
-                    "flash_prog_buffer_base" : 0x10081000,
-                    "devid": (0xf001da30, 0x44),
-                    "csum_vec": 7,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1837" : {
-                    "flash_sector" : FLASH_SECTORS['lpc18xx'],
-                    "flash_bank_addr": (0x1a000000, 0x1b000000),
-                    "flash_prog_buffer_base" : 0x10081000,
-                    "devid": (0xf001da30, 0),
-                    "csum_vec": 7,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1853" : {
-                    "flash_sector" : FLASH_SECTORS['lpc18xx'],
-                    "flash_sector_count": 11,
-                    "flash_bank_addr": (0x1a000000, 0x1b000000),
-                    "flash_prog_buffer_base" : 0x10081000,
-                    "devid": (0xf001d830, 0),
-                    "csum_vec": 7,
-                    "cpu_type": "thumb",
-                    },
-            "lpc1857" : {
-                    "flash_sector" : FLASH_SECTORS['lpc18xx'],
-                    "flash_bank_addr": (0x1a000000, 0x1b000000),
-                    "flash_prog_buffer_base" : 0x10081000,
-                    "devid": (0xf001d830, 0x44),
-                    "csum_vec": 7,
-                    "cpu_type": "thumb",
-                    },
-        }
+    _loaded = None
+
+    def __init__(self, filename):
+        parser = configparser.ConfigParser(interpolation=None)
+        with open(filename, 'r') as fd:
+            parser.read_file(fd)
+
+        self.sector_tables = {}
+        for section in parser.sections():
+            if section.startswith(self.SECTORS_PREFIX):
+                name = section[len(self.SECTORS_PREFIX):]
+                self.sector_tables[name] = _ints(parser[section]['sizes'])
+
+        self.chips = {}
+        for section in parser.sections():
+            if not section.startswith(self.SECTORS_PREFIX):
+                self.chips[section] = self._parse_chip(filename, section,
+                        parser[section])
+
+        self.layouts = {}
+        # J reply words -> chip name, first J reply word -> reply length
+        self.devids = {}
+        self.devid_words = {}
+        for name, params in self.chips.items():
+            self.layouts[name] = self._layout(params)
+
+            devid = params.get('devid')
+            if devid is None:
+                continue
+            if not isinstance(devid, tuple):
+                devid = (devid, )
+            if devid in self.devids:
+                raise ValueError('{}: {} and {} share the same devid'.format(
+                    filename, self.devids[devid], name))
+            self.devids[devid] = name
+            self.devid_words[devid[0]] = len(devid)
+
+    @classmethod
+    def load(cls):
+        """Return the database, read on first use."""
+        if cls._loaded is None:
+            # bundled next to the executable by PyInstaller
+            path = getattr(sys, '_MEIPASS',
+                    os.path.dirname(os.path.abspath(__file__)))
+            cls._loaded = cls(os.path.join(path, cls.FILENAME))
+        return cls._loaded
+
+    def _parse_chip(self, filename, name, section):
+        params = {}
+        for key, value in section.items():
+            if key not in self.PARAMETERS:
+                raise ValueError('{}: unknown parameter {} for {}'.format(
+                    filename, key, name))
+            try:
+                params[key] = self.PARAMETERS[key](value)
+            except ValueError as e:
+                raise ValueError('{}: bad {} for {}: {}'.format(
+                    filename, key, name, e)) from None
+
+        table = params.get('flash_sector')
+        if table is not None:
+            if table not in self.sector_tables:
+                raise ValueError('{}: unknown sector table {} for {}'.format(
+                    filename, table, name))
+            params['flash_sector'] = self.sector_tables[table]
+        return params
+
+    def _layout(self, params):
+        banks = params.get('flash_bank_addr') or (0, )
+        table = params.get('flash_sector', ())
+        count = params.get('flash_sector_count', len(table))
+
+        sectors = []
+        for bank, addr in enumerate(banks):
+            for sector, size in enumerate(table[:count]):
+                sectors.append(FlashSector(bank, sector, addr, size * 1024))
+                addr += size * 1024
+        sectors.sort(key=lambda s: s.start)
 
+        block_size = params.get('flash_prog_buffer_size',
+                self.FLASH_BUFFER_SIZE_DEFAULT)
+        ram_buffer = RamBuffer(
+                params.get('flash_prog_buffer_base',
+                    self.FLASH_BUFFER_BASE_DEFAULT),
+                block_size,
+                params.get('flash_prog_ram_size', block_size))
+
+        return ChipLayout(banks, tuple(sectors), [s.start for s in sectors],
+                sum(s.size for s in sectors), ram_buffer)
+
+
+class _DatabaseAttribute(object):
+    """Class attribute reading the chip database on first access."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        return getattr(ChipDatabase.load(), self.name)
+
+
+class NXPchip(object):
+    FLASH_SECTORS = _DatabaseAttribute('sector_tables')
+    CPUS = _DatabaseAttribute('chips')
 
     def __init__(self, cpu):
         if cpu not in self.CPUS:
             raise ValueError('Unknown CPU: {}'.format(cpu))
 
         self._cpu = cpu
+        self._layout = ChipDatabase.load().layouts[cpu]
 
     def get_parameter(self, key, default=None):
         if not self.CPUS[self._cpu]:
@@ -306,3 +185,63 @@ class NXPchip(object):
     @property
     def name(self):
         return str(self._cpu)
+
+    @classmethod
+    def from_devid(cls, devid):
+        """Return the chip answering devid to the J command, or None."""
+        if not isinstance(devid, tuple):
+            devid = (devid, )
+        name = ChipDatabase.load().devids.get(devid)
+        return cls(name) if name else None
+
+    @classmethod
+    def devid_words_for(cls, first_word):
+        """Number of words replied to J by the chips starting with first_word."""
+        return ChipDatabase.load().devid_words.get(first_word)
+
+    @property
+    def devid(self):
+        """Words replied to the J command, None when unknown."""
+        devid = self.get_parameter('devid')
+        if devid is None or isinstance(devid, tuple):
+            return devid
+        return (devid, )
+
+    @property
+    def flash_banks(self):
+        """Base address of each flash bank, (0, ) for chips without banks."""
+        return self._layout.banks
+
+    @property
+    def flash_sectors(self):
+        """All the FlashSector of the chip, sorted by address."""
+        return self._layout.sectors
+
+    @property
+    def flash_size(self):
+        """Total flash size, all banks included."""
+        return self._layout.flash_size
+
+    @property
+    def flash_bank_size(self):
+        return self._layout.flash_size // len(self._layout.banks)
+
+    @property
+    def ram_buffer(self):
+        """RamBuffer used to stage the data written to flash."""
+        return self._layout.ram_buffer
+
+    def find_sector(self, addr):
+        """Return the FlashSector holding addr, or None."""
+        starts, sectors = self._layout.starts, self._layout.sectors
+        i = bisect.bisect_right(starts, addr) - 1
+        if i >= 0 and addr < sectors[i].start + sectors[i].size:
+            return sectors[i]
+        return None
+
+    def sectors_in_range(self, start, end):
+        """Return the FlashSector overlapping [start, end), sorted by address."""
+        starts, sectors = self._layout.starts, self._layout.sectors
+        first = max(bisect.bisect_right(starts, start) - 1, 0)
+        last = bisect.bisect_left(starts, end)
+        return [s for s in sectors[first:last] if s.start + s.size > start]
@@ -24,14 +24,21 @@
 # processors.
 
 import binascii
+import hashlib
 import sys
-import struct
 import getopt
 import logging
+import mmap
+import os
+import time
 from pathlib import Path
 
+import elf
 import ihex
-from nxpchips import NXPchip
+import srec
+from image import FlashImage
+from journal import RangeJournal
+from nxpchips import ChipDatabase, NXPchip
 from programmers import find_programmer, ProgrammerError
 
 logger = logging.getLogger('NXPprog')
@@ -43,28 +50,151 @@ ch.setFormatter(fmt)
 logger.addHandler(ch)
 
 
+class LinkError(Exception):
+    pass
+
+
+class GarbledCommand(LinkError):
+    # a command echoed by the target differently than it was sent, with the
+    # return code of the command the target got
+    def __init__(self, cmd, echo, code):
+        super().__init__('Command {!r} echoed as {!r}'.format(cmd, echo))
+        self.cmd = cmd
+        self.echo = echo
+        self.code = code
+
+
+class DumpWriter(object):
+    # file like object writing into a memory mapped dump, the ranges written
+    # are recorded in the journal once they are flushed to the file
+    def __init__(self, mm, journal, journal_size):
+        self.mm = mm
+        self.journal = journal
+        self.journal_size = journal_size
+        self.pos = self.saved = 0
+
+    def seek(self, pos):
+        self.sync()
+        self.pos = self.saved = pos
+
+    def write(self, data):
+        self.mm[self.pos:self.pos + len(data)] = data
+        self.pos += len(data)
+        if self.pos - self.saved >= self.journal_size:
+            self.sync()
+        return len(data)
+
+    def sync(self):
+        if self.pos > self.saved:
+            self.mm.flush()
+            self.journal.add(self.saved, self.pos)
+            self.saved = self.pos
+
+    def close(self):
+        self.sync()
+        self.mm.close()
+
+
 class NXPprog(object):
     BAUDRATES = (9600, 19200, 38400, 57600, 115200, 230400)
+    # with --baudrate auto, sync at a safe rate then step up while the link
+    # stays clean
+    AUTO_BAUDRATE_SYNC = 57600
+    AUTO_BAUDRATES = (115200, 230400, 460800, 921600)
+    # bytes written then read back to check a baudrate
+    BAUDRATE_PROBE_SIZE = 4096
+    # link errors tolerated before falling back to a lower baudrate
+    LINK_ERRORS_MAX = 2
+    # tries of each lower baudrate when falling back
+    BAUDRATE_FALLBACK_ATTEMPTS = 3
     OK = 'OK'
     RESEND = 'RESEND'
+    # line taken by the target neither for a command nor for a checksum
+    FILLER = '#'
     SYNC_STR = 'Synchronized'
 
-    # for calculations in 32 bit modulo arithmetic
-    U32_MOD = (2 ** 32)
+    # ISP return codes
+    CMD_SUCCESS = 0
+    SECTOR_NOT_BLANK = 8
+    COMPARE_ERROR = 10
+    # return codes of commands rejected before doing anything, which can be
+    # sent again when the link corrupted them
+    REJECTED = (1, 2, 3, 4, 5, 6, 7, 12, 13, 14)
+
     # uuencoded line length
     UU_LINE_SIZE = 45
     # uuencoded block length
     UU_BLOCK_SIZE = UU_LINE_SIZE * 20
-
-    FLASH_BUFFER_BASE_DEFAULT = 0x40001000
-    FLASH_BUFFER_SIZE_DEFAULT = 4096  # Can be 256, 512, 1024 or 4096
+    # transfer sizes to fall back to on a noisy link, each one a multiple of
+    # both the line length and 4 bytes
+    UU_BLOCK_SIZES = (UU_BLOCK_SIZE, UU_LINE_SIZE * 8, UU_LINE_SIZE * 4)
+    # start of each flash bank the boot rom may remap while in ISP mode
+    VECTOR_TABLE_SIZE = 64
+    # largest R command, long reads are split in several of them
+    READ_COMMAND_SIZE = UU_BLOCK_SIZE * 64
+    # data read into a file between two journal updates
+    READ_JOURNAL_SIZE = UU_BLOCK_SIZE * 16
+
+    # times a UU block is sent again when the target asks for it
+    RESEND_RETRIES = 8
+    # a block sent again that many times makes the next transfers smaller
+    RESEND_SHRINK = 2
+    # blocks moved without errors before smaller transfers grow back
+    CLEAN_BLOCKS_GROW = 64
+    # extra waits for the reply to a UU block
+    TIMEOUT_RETRIES = 2
+    # times a block of the data left by a failed W is sent before the
+    # target is given up
+    FINISH_RETRIES = 64
+
+    # reply deadlines: wire time of the bytes exchanged at 10 bits per byte,
+    # plus the link round trip, plus the time the target needs to process
+    # the command, plus a margin
+    SYNC_TIMEOUT = 0.3
+    LINK_LATENCY_DEFAULT = 0.02
+    LINK_LATENCY_MIN = 0.005
+    TIMEOUT_MARGIN = 0.05
+    # worst case target processing times, in seconds
+    ERASE_TIME = 0.4            # per sector
+    BLANK_CHECK_TIME = 0.01     # per sector
+    COPY_TIME = 0.005           # per 256 bytes
+    # reply to a command: status line and a few result lines
+    REPLY_SIZE = 16
+
+    FLASH_BUFFER_BASE_DEFAULT = ChipDatabase.FLASH_BUFFER_BASE_DEFAULT
+    FLASH_BUFFER_SIZE_DEFAULT = ChipDatabase.FLASH_BUFFER_SIZE_DEFAULT
 
     def __init__(self, **kwargs):
         self.programmer = None
         self.echo_on = 1
+        self.binary = False
 
         self.device = kwargs.pop('device')
         self.baudrate = kwargs.pop('baudrate', 115200)
+        self.auto_baudrate = self.baudrate == 'auto'
+        if self.auto_baudrate:
+            self.baudrate = self.AUTO_BAUDRATE_SYNC
+        # baudrates checked by a write/read round trip
+        self.baudrates = [self.baudrate]
+        # RESEND and checksum errors since the last baudrate change
+        self.link_errors = 0
+        # round trip of the link on top of the wire time, calibrated on sync
+        self.link_latency = self.LINK_LATENCY_DEFAULT
+        # UU blocks sent again over the session
+        self.retries = 0
+        # once the link corrupted data in a stage, its W, P and C commands
+        # are echoed and checked, its staged data is read back and each of
+        # its copies is compared with the ram
+        self.link_checked = False
+        # data moved by each W or R command, the whole data when the link is
+        # clean
+        self.uu_block_size = self.UU_BLOCK_SIZE
+        # blocks moved without errors since the last one
+        self.clean_blocks = 0
+        # data the target still waits for after a failed W
+        self.write_pending = 0
+        # time the binary data written without a reply leaves the wire
+        self.wire_busy = 0.0
         self.programmer_name = kwargs.pop('programmer', 'serial')
         self.xonxoff = kwargs.pop('xonxoff', False)
         self.control_isp_mode = kwargs.pop('control', False)
@@ -77,6 +207,16 @@ class NXPprog(object):
 
         self.oscfreq = kwargs.pop('oscfreq', 16000)
 
+        # directory of the programming session journals, None to keep none
+        self.session_dir = kwargs.pop('session_dir', None)
+        # journal of the blocks copied to flash by the current session
+        self.session = None
+        # compare each block with the flash right after copying it
+        self.verify_writes = kwargs.pop('verify_writes', False)
+
+        # erased flash content, sized like the last block checked
+        self._blank = b''
+
     def init_programmer(self):
         if self.programmer:
             raise OSError('Programmer already started')
@@ -89,11 +229,10 @@ class NXPprog(object):
             logger.error('Could not start programmer: {!s}'.format(e))
             raise e
 
-        # set a two second timeout just in case there is nothing connected
-        # or the device is in the wrong mode.
-        # This timeout is too short for slow baud rates but who wants to
-        # use them?
-        self.programmer.timeout = 0.3
+        # short timeout just in case there is nothing connected or the device
+        # is in the wrong mode, replies are then waited for with deadlines
+        # computed for each exchange
+        self.programmer.timeout = self.SYNC_TIMEOUT
         # device wants Xon Xoff flow control
         self.programmer.xonxoff = 1
 
@@ -103,46 +242,267 @@ class NXPprog(object):
         self.programmer.post_isp_mode()
         self.connection_init()
 
-        self.banks = self.cpu.get_parameter("flash_bank_addr", 0)
+        # base address of each flash bank, (0, ) for chips without banks
+        self.banks = self.cpu.flash_banks
 
-        if self.banks == 0:
+        if self.cpu.get_parameter("flash_bank_addr", 0) == 0:
             self.sector_commands_need_bank = 0
         else:
             self.sector_commands_need_bank = 1
 
+        # newer bootloaders move W and R payloads as raw bytes, without UU
+        # encoding nor checksums
+        self.binary = bool(self.cpu.get_parameter("isp_binary", False))
+
+        if self.auto_baudrate:
+            self.negotiate_baudrate()
+
     def connection_init(self):
         self.sync(self.oscfreq)
 
         if not self.cpu:
             devid = self.get_devid()
-            for dcpu in NXPchip.CPUS.keys():
-                cpu_devid = NXPchip.CPUS[dcpu].get("devid")
-                if not cpu_devid:
-                    continue
-                if devid == cpu_devid:
-                    logger.info("Chip detected: %s" % dcpu.upper())
-                    self.cpu = NXPchip(dcpu)
-                    break
-            if not self.cpu:
-                logger.error("Cannot autodetect from device id %d(0x%x), set cpu name manually" %
-                        (devid, devid))
+            self.cpu = NXPchip.from_devid(devid)
+            if self.cpu:
+                logger.info("Chip detected: %s" % self.cpu.name.upper())
+            else:
+                if not isinstance(devid, tuple):
+                    devid = (devid, )
+                logger.error("Cannot autodetect from device id %s, set cpu name manually" %
+                        ' '.join('%d(0x%x)' % (d, d) for d in devid))
+                sys.exit(1)
 
         # unlock write commands
         self.isp_command("U 23130")
 
 
-    def isp_command(self, cmd):
-        self.programmer.writeln(cmd.encode())
-
-        # throw away echo data
-        if self.echo_on:
-            self.programmer.readline()
-
-        status = self.programmer.readline()
-        if int(status) != 0:
+    def timeout(self, nbytes, latency=0.0):
+        # deadline for an exchange moving nbytes over the wire, behind the
+        # data still queued for it
+        queued = max(self.wire_busy - time.monotonic(), 0.0)
+        return queued + nbytes * 10 / self.baudrate + self.link_latency + \
+                latency + self.TIMEOUT_MARGIN
+
+    def calibrate_latency(self, elapsed, nbytes):
+        # round trip of the link measured on a command without processing
+        latency = elapsed - nbytes * 10 / self.baudrate
+        self.link_latency = max(2 * latency, self.LINK_LATENCY_MIN)
+        self.programmer.timeout = self.timeout(self.REPLY_SIZE)
+        logger.debug('Link latency %.1fms', self.link_latency * 1000)
+
+    def isp_command(self, cmd, allowed=(CMD_SUCCESS, ), latency=0.0,
+            check_echo=False):
+        if check_echo:
+            self.check_commands()
+        timeout = self.timeout(len(cmd) + self.REPLY_SIZE, latency)
+        for attempt in range(self.RESEND_RETRIES + 1):
+            self.programmer.writeln(cmd.encode())
+
+            # the echo shows the command the target got, thrown away unless
+            # it is checked
+            echo = None
+            if self.echo_on:
+                echo = self.programmer.readline(timeout)
+
+            # return codes listed in allowed are left to the caller, all of
+            # them when allowed is None
+            status = self.programmer.readline(timeout)
+            try:
+                code = int(status)
+            except ValueError:
+                raise LinkError('Invalid reply to {!r} command: {!r}'.format(
+                    cmd, status)) from None
+            if allowed is None or code in allowed or \
+                    code not in self.REJECTED:
+                break
+
+            # the command got through unchanged, its status was garbled on
+            # the way back
+            if check_echo and echo == cmd:
+                self.link_error()
+                code = self.CMD_SUCCESS
+                break
+
+            # a command garbled on the way was rejected without any effect
+            self.link_error()
+            self.retries += 1
+            self.flush_input()
+
+        # a command garbled into another valid one may have done something
+        # else than asked
+        if check_echo and echo is not None and echo != cmd and \
+                code not in self.REJECTED:
+            self.link_error()
+            raise GarbledCommand(cmd, echo, code)
+
+        if allowed is not None and code not in allowed:
             logger.error('Error with {!r} command: {}'.format(cmd, status))
             sys.exit(1)
 
+        return code
+
+    def check_commands(self):
+        # on a link that corrupts data, commands can be garbled into other
+        # valid ones: the echo is on to catch them for the rest of a stage
+        # that saw link errors
+        if self.link_checked and not self.echo_on:
+            logger.info('Link errors, checking the commands and copies of the stage')
+            self.isp_command("A 1")
+            self.echo_on = 1
+        elif not self.link_checked and self.echo_on:
+            self.isp_command("A 0")
+            self.echo_on = 0
+
+    def set_link_baudrate(self, baudrate):
+        self.programmer.set_baudrate(baudrate)
+        self.baudrate = baudrate
+
+    def change_baudrate(self, baudrate):
+        # the host port is first tried at the baudrate, raising a
+        # ProgrammerError when it cannot take it; the target replies at the
+        # current baudrate, then switches; any other reply keeps the current
+        # baudrate
+        self.programmer.set_baudrate(baudrate)
+        self.programmer.set_baudrate(self.baudrate)
+        status = self.isp_command("B %d 1" % baudrate, allowed=None)
+        if status != self.CMD_SUCCESS:
+            return False
+        self.set_link_baudrate(baudrate)
+        return True
+
+    def flush_input(self):
+        self.programmer.clear_buffer()
+        if self.programmer.in_waiting:
+            self.programmer.read(self.programmer.in_waiting)
+
+    def probe_link(self):
+        # a write then read back of a ram block, without any error; the
+        # errors of a probe are left out of the session counters, so that a
+        # rate given up does not weigh on the one kept
+        ram_addr = self.cpu.ram_buffer.base
+        pattern = bytes(range(256)) * (self.BAUDRATE_PROBE_SIZE // 256)
+        counters = (self.link_errors, self.retries, self.clean_blocks,
+                self.uu_block_size, self.link_checked)
+        try:
+            self.write_ram_data(ram_addr, pattern)
+            passed = self.read_block(ram_addr, len(pattern)) == pattern
+        except LinkError:
+            # the target may still wait for the data written or be sending
+            # the data read
+            if self.write_pending:
+                self.finish_write()
+            else:
+                self.abort_read()
+            passed = False
+        passed = passed and self.link_errors == counters[0]
+        (self.link_errors, self.retries, self.clean_blocks,
+                self.uu_block_size, self.link_checked) = counters
+        return passed
+
+    def negotiate_baudrate(self):
+        try:
+            self.programmer.set_baudrate(self.baudrate)
+        except ProgrammerError as e:
+            logger.warning('Keeping %d baud: %s', self.baudrate, e)
+            return
+
+        for baudrate in self.AUTO_BAUDRATES:
+            if baudrate <= self.baudrate:
+                continue
+            try:
+                if not self.change_baudrate(baudrate):
+                    break
+            except ProgrammerError as e:
+                # the fastest baudrate the host port takes
+                logger.info('Keeping %d baud: %s', self.baudrate, e)
+                break
+            except LinkError:
+                break
+            if not self.probe_link():
+                logger.info('Link unstable at %d baud', baudrate)
+                self.lower_baudrate()
+                break
+            self.baudrates.append(baudrate)
+
+        logger.info('Using %d baud', self.baudrate)
+
+    def lower_baudrate(self):
+        # the previous baudrates are tried from the fastest one down, a
+        # baudrate that cannot be probed cleanly is given up for the next one
+        lower = [b for b in self.baudrates if b < self.baudrate]
+        if not lower:
+            return False
+        self.finish_write()
+
+        # baudrates the target may be listening at: after a failed probe it
+        # may have switched or not
+        rates = [self.baudrate]
+        for i in range(len(lower), 0, -1):
+            baudrate = lower[i - 1]
+            for attempt in range(self.BAUDRATE_FALLBACK_ATTEMPTS):
+                for rate in rates:
+                    self.set_link_baudrate(rate)
+                    self.flush_input()
+                    try:
+                        status = self.isp_command("B %d 1" % baudrate,
+                                allowed=None)
+                    except LinkError:
+                        # the reply may be lost while the target already
+                        # switched
+                        continue
+                    if status == self.CMD_SUCCESS:
+                        break
+                    # refused or garbled reply
+                    self.link_error()
+                self.set_link_baudrate(baudrate)
+                if baudrate not in rates:
+                    rates.append(baudrate)
+                if self.probe_link():
+                    self.baudrates = lower[:i]
+                    self.link_errors = 0
+                    self.uu_block_size = self.UU_BLOCK_SIZE
+                    return True
+
+        raise LinkError('Cannot fall back to a lower baudrate')
+
+    def check_link(self):
+        # errors showing up mid-flash: drop to the previous baudrate
+        if self.auto_baudrate and self.link_errors >= self.LINK_ERRORS_MAX:
+            if self.lower_baudrate():
+                logger.warning('Link errors, baudrate lowered to %d',
+                        self.baudrate)
+
+    def compare(self, addr1, addr2, count):
+        # offset of the first difference, None if both ranges match; a
+        # garbled compare has no effect and is run again
+        for attempt in range(self.RESEND_RETRIES + 1):
+            try:
+                status = self.isp_command("M %d %d %d" % (addr1, addr2,
+                        count), allowed=(self.CMD_SUCCESS, self.COMPARE_ERROR),
+                        check_echo=True)
+                break
+            except GarbledCommand:
+                if attempt == self.RESEND_RETRIES:
+                    raise
+                self.retries += 1
+                self.flush_input()
+        if status == self.COMPARE_ERROR:
+            return int(self.programmer.readline())
+        return None
+
+    def compare_flash(self, flash_addr, ram_addr, count):
+        # same as compare, the vector table at the start of a bank being left
+        # out as the boot rom may remap it while in ISP mode
+        skip = 0
+        if flash_addr in self.banks:
+            skip = min(self.VECTOR_TABLE_SIZE, count)
+        if skip == count:
+            return None
+        offset = self.compare(flash_addr + skip, ram_addr + skip, count - skip)
+        if offset is None:
+            return None
+        return offset + skip
+
 
     def sync(self, osc):
         self.programmer.write(b'?')
@@ -176,6 +536,7 @@ class NXPprog(object):
             logger.error("No OK string read while setting OSC (got {}, expected {})".format(s, self.OK))
             sys.exit(1)
 
+        started = time.monotonic()
         self.programmer.writeln('A 0'.encode())
         # discard echo
         s = self.programmer.readline()
@@ -184,265 +545,921 @@ class NXPprog(object):
             logger.warn("Disabling echo failed")
 
         self.echo_on = 0
+        # 4 bytes sent, 5 bytes of echo and 3 bytes of status
+        self.calibrate_latency(time.monotonic() - started, 12)
 
 
     def sum(self, data):
-        s = 0
-        for i in data:
-            s += int(i)
-        return s
+        return sum(data)
 
+    def uuencode_block(self, data):
+        # encode an UU block followed by its checksum line so that it can be
+        # sent with a single write
+        view = memoryview(data)
+        lines = [binascii.b2a_uu(view[i:i + self.UU_LINE_SIZE])
+                for i in range(0, len(view), self.UU_LINE_SIZE)]
+        lines.append(b'%d\n' % self.sum(view))
+        return b''.join(lines)
 
     def write_ram_block(self, addr, data):
         data_len = len(data)
 
-        self.isp_command("W %d %d\n" % ( addr, data_len ))
-
-        for i in range(0, data_len, self.UU_LINE_SIZE):
-            c_line_size = data_len - i
-            if c_line_size > self.UU_LINE_SIZE:
-                c_line_size = self.UU_LINE_SIZE
-            block = data[i:i+c_line_size]
-            bstr = binascii.b2a_uu(block)
-            self.programmer.write(bstr)
-
-
-        self.programmer.writeln(('%s' % self.sum(data)).encode())
-        status = self.programmer.readline()
-        if not status:
-            return "timeout"
-        if status == self.RESEND:
-            return "resend"
-        if status == self.OK:
+        # a single write command for the whole data, the target checks and
+        # acknowledges each UU block on its own
+        garbled = None
+        # length of the data the target may wait for
+        count = data_len
+        try:
+            self.isp_command("W %d %d" % ( addr, data_len ), check_echo=True)
+        except GarbledCommand as e:
+            if e.code != self.CMD_SUCCESS:
+                raise
+            # the target waits for the data of the command it got, the echo
+            # may as well have been garbled on the way back: the data is sent
+            # all the same to stay in sync, then written again
+            garbled = e
+            try:
+                count = int(e.echo.split()[2])
+            except (IndexError, ValueError):
+                pass
+        except LinkError:
+            # a W sent again once its success was garbled into a rejection
+            # is taken for data: given up with that block, the target waits
+            # for the data of the first one
+            if self.binary or not self.resync_block():
+                raise
+
+        if self.binary:
+            self.programmer.write(data)
+            self.wire_busy = max(self.wire_busy, time.monotonic()) + \
+                    data_len * 10 / self.baudrate
+            if garbled:
+                raise garbled
+            self.clean_block(-(-data_len // self.UU_BLOCK_SIZE))
             return ""
 
-        logger.error('Unknown status: {}'.format(status))
-        sys.exit(1)
-
-    def uudecode(self, line):
-        try:
-            return binascii.a2b_uu(line)
-        except binascii.Error:
-            nbytes = (((ord(line[0])-32) & 63) * 4 + 5) // 3
-            return binascii.a2b_uu(line[:nbytes])
+        # a W echoed with another length leaves the target waiting for either
+        # one: the data is cut or padded to the shorter one first, then to
+        # the longer one if the target waits for more
+        size = min(data_len, count)
+        view = memoryview(bytes(data[:size]) if size < data_len else data)
+        i = 0
+        while i < size:
+            block = self.uuencode_block(view[i:i + self.UU_BLOCK_SIZE])
+            for attempt in range(self.RESEND_RETRIES + 1):
+                status = self.send_block(block)
+                if not status and self.resync_block():
+                    status = self.RESEND
+                    if size < max(data_len, count):
+                        size = max(data_len, count)
+                        view = memoryview(bytes(data).ljust(size, b'\xff'))
+                        block = self.uuencode_block(
+                                view[i:i + self.UU_BLOCK_SIZE])
+                status = self.block_reply(status)
+                if status != self.RESEND:
+                    break
+                self.resent(attempt)
+            # the target waits for the rest of the data before taking
+            # commands again
+            if not status:
+                self.write_pending = size - i
+                return "timeout"
+            if status == self.RESEND:
+                self.write_pending = size - i
+                return "resend"
+            if status != self.OK:
+                return "unknown status {!r}".format(status)
+            if not attempt:
+                self.clean_block()
+            i += self.UU_BLOCK_SIZE
+
+        if garbled:
+            raise garbled
+        return ""
+
+    def send_block(self, block):
+        # a UU block and its checksum line, the reply of the target
+        timeout = self.timeout(len(block) + self.REPLY_SIZE)
+        self.programmer.write(block)
+        # the lines sent come back first when echo is on
+        if self.echo_on:
+            self.programmer.readlines(block.count(b'\n'), timeout)
+        status = self.programmer.readline(timeout)
+        # a late reply is waited for before giving up
+        for wait in range(self.TIMEOUT_RETRIES):
+            if status:
+                break
+            status = self.programmer.readline(timeout)
+        return status
+
+    def finish_write(self):
+        # the target takes no command until it got all the data of a W: the
+        # data left by a failed one is sent as blocks of 0xff in lines of 4
+        # bytes, which get through a noisy link more often than full ones
+        line = binascii.b2a_uu(b'\xff' * 4)
+        while self.write_pending > 0:
+            size = min(self.write_pending, 4 * 20)
+            block = line * (size // 4) + b'%d\n' % (0xff * size)
+            for attempt in range(self.FINISH_RETRIES):
+                status = self.send_block(block)
+                if not status and self.resync_block():
+                    status = self.RESEND
+                status = self.block_reply(status)
+                if status != self.RESEND:
+                    break
+            if status != self.OK:
+                break
+            self.write_pending -= size
+        self.write_pending = 0
+        self.flush_input()
+
+    def resync_block(self):
+        # a block with a garbled line length leaves the target waiting for
+        # lines it will never get: filler lines are sent one at a time until
+        # it gives up the block with a RESEND, a block being at most 20
+        # lines and its checksum; False when the target takes commands
+        timeout = self.timeout(len(self.FILLER) + 2 + self.REPLY_SIZE)
+        for _ in range(21):
+            self.programmer.writeln(self.FILLER.encode())
+            # filler lines come back first when echo is on
+            while True:
+                reply = self.programmer.readline(timeout)
+                if not reply or self.block_reply(reply) == self.RESEND:
+                    break
+                if reply.isdigit():
+                    self.flush_input()
+                    return False
+            if reply:
+                logger.warning('Missing reply to a block, target back in sync')
+                self.flush_input()
+                return True
+        return False
+
+    def block_reply(self, status):
+        # a reply to a UU block garbled on the way back is told by its length
+        if not status or status in (self.OK, self.RESEND):
+            return status
+        for reply in (self.OK, self.RESEND):
+            if len(status) == len(reply):
+                self.link_error()
+                return reply
+        return status
+
+    def link_error(self):
+        self.link_errors += 1
+        self.clean_blocks = 0
+        self.link_checked = True
+
+    def resent(self, attempt):
+        self.link_error()
+        self.retries += 1
+        if attempt + 1 == self.RESEND_SHRINK:
+            self.shrink_block_size()
+
+    def clean_block(self, count=1):
+        # transfers grow back to full size once the link stays clean
+        self.clean_blocks += count
+        if self.uu_block_size < self.UU_BLOCK_SIZE and \
+                self.clean_blocks >= self.CLEAN_BLOCKS_GROW:
+            self.uu_block_size = self.UU_BLOCK_SIZE
+            logger.info('Link clean again, moving whole data per command')
+
+    def shrink_block_size(self):
+        smaller = [s for s in self.UU_BLOCK_SIZES if s < self.uu_block_size]
+        if smaller:
+            self.uu_block_size = smaller[0]
+            logger.warning('Repeated transfer errors, moving %d bytes per '
+                    'command', self.uu_block_size)
+
+    def transfer_size(self, size):
+        # one command for all the data until blocks had to be resent
+        if self.uu_block_size < self.UU_BLOCK_SIZE:
+            return min(size, self.uu_block_size)
+        return size
+
+    def uudecode_block(self, lines, out, offset=0):
+        # decode the lines of an UU block into out starting at offset, each
+        # line cut to the characters announced by its length so that
+        # trailing garbage is ignored; returns the number of bytes decoded
+        view = memoryview(out)
+        start = offset
+        for line in lines:
+            if not line:
+                raise binascii.Error('Empty line')
+            size = (ord(line[:1]) - 32) & 63
+            if offset + size > len(view):
+                raise binascii.Error('Line longer than the block')
+            view[offset:offset + size] = \
+                    binascii.a2b_uu(line[:(size * 4 + 5) // 3])
+            offset += size
+        return offset - start
 
     def read_serialnumber(self):
-        sn = ['0x%x' % x for x in self.get_devsn()]
+        devsn = self.get_devsn()
+        sn = ['0x%x' % x for x in devsn]
         logger.info('Device S/N: %s', ' '.join(sn))
+        return devsn
 
     def read_block(self, addr, data_len, fd=None):
         if data_len % 4:
             logger.error("Data length must be a multiple of 4")
             sys.exit(1)
-        self.isp_command("R %d %d\n" % ( addr, data_len ))
-
-        expected_lines = int(data_len / (self.UU_LINE_SIZE - 1))
-
-        data = b""
+        if self.binary:
+            return self.read_block_binary(addr, data_len, fd)
+
+        # decoded in place, in the whole data or in a single UU block when
+        # it goes to fd
+        data = bytearray(self.UU_BLOCK_SIZE if fd else data_len)
+        view = memoryview(data)
+        offset = 0
         remaining_data_len = data_len
         current_addr = addr
-        for i in range(0, expected_lines, 20):
-            lines = expected_lines - i
-            if lines > 20:
-                lines = 20
-            cdata = b""
-            data_read_len = 0
-            for i in range(0, lines):
-                line = self.programmer.readline(timeout=0.5)
-                try:
-                    decoded = self.uudecode(line)
-                except binascii.Error as e:
-                    logger.warn("Could no decode line: %s", str(e))
-                remaining_data_len -= len(decoded)
-                data_read_len += len(decoded)
-                cdata += decoded
-
-            s = self.programmer.readline()
-
-            if int(s) != self.sum(cdata):
-                logger.error("Checksum mismatch on read got %x expected %x. Retrying.",
-                             int(s), self.sum(data))
-                sys.exit(1)
-            else:
-                self.programmer.writeln(self.OK.encode())
+        while remaining_data_len:
+            read_len = min(self.transfer_size(remaining_data_len),
+                    self.READ_COMMAND_SIZE)
+            self.isp_command("R %d %d" % (current_addr, read_len))
+
+            expected_lines = (read_len + self.UU_LINE_SIZE - 1) // self.UU_LINE_SIZE
+
+            for i in range(0, expected_lines, 20):
+                lines = expected_lines - i
+                if lines > 20:
+                    lines = 20
+                # a block and its checksum are read with a single deadline,
+                # a full line being 61 characters and its line end; the
+                # lines hold at least their length and data characters
+                block_len = min(read_len - i * self.UU_LINE_SIZE,
+                        lines * self.UU_LINE_SIZE)
+                block_size = 2 * lines + 2 + (block_len + 2) // 3 * 4
+                timeout = self.timeout(63 * (lines + 1))
+                if fd:
+                    offset = 0
+                cdata = view[offset:offset + block_len]
+                for attempt in range(self.RESEND_RETRIES + 1):
+                    block = self.programmer.readlines(lines + 1, timeout,
+                            size=block_size)
+                    s = block.pop() if len(block) > lines else ''
+                    try:
+                        decoded = self.uudecode_block(block, cdata)
+                    except binascii.Error as e:
+                        logger.warn("Could not decode block: %s", str(e))
+                        decoded = None
+
+                    if decoded == block_len and s == str(self.sum(cdata)):
+                        break
+
+                    if attempt == self.RESEND_RETRIES:
+                        self.abort_read()
+                        raise LinkError("Checksum mismatch on read got %s expected %x" %
+                                     (s, self.sum(cdata)))
+                    # the target sends the same block again, once the rest
+                    # of the garbled one is dropped
+                    self.resent(attempt)
+                    self.flush_input()
+                    self.acknowledge(self.RESEND)
+                self.acknowledge(self.OK, lines)
+                if not attempt:
+                    self.clean_block()
+
+                remaining_data_len -= block_len
+                progress = (remaining_data_len / data_len) * 100
+                logger.info('Read %d bytes at 0x%-6x    (%3.0f%%)',
+                            block_len, current_addr, 100-progress)
+                current_addr += block_len
+
+                if fd:
+                    fd.write(cdata)
+                else:
+                    offset += block_len
 
-            progress = (remaining_data_len / data_len) * 100
-            logger.info('Read %d bytes at 0x%-6x    (%3.0f%%)',
-                        data_read_len, current_addr, 100-progress)
-            current_addr += data_read_len
+        if fd:
+            return None
+        else:
+            return data
 
-            if fd:
-                fd.write(cdata)
-            else:
-                data += cdata
+    def acknowledge(self, reply, lines=0):
+        # the reply to a block read, which the target echoes before going on;
+        # an OK garbled on the way has the block of the given lines sent
+        # again, which is dropped
+        for attempt in range(self.RESEND_RETRIES + 1):
+            self.programmer.writeln(reply.encode())
+            if not self.echo_on:
+                return
+            echo = self.programmer.readline(self.timeout(len(reply) + 2))
+            if echo == reply or reply != self.OK:
+                return
+            if len(self.programmer.readlines(lines + 1,
+                    self.timeout(63 * (lines + 1)))) < 2:
+                return
+            self.link_error()
+
+    def abort_read(self):
+        # the target takes commands again only once every block of the read
+        # is acknowledged: the blocks left are acknowledged unread until the
+        # target stops sending them, a block being at least two lines
+        for _ in range(self.READ_COMMAND_SIZE // self.UU_BLOCK_SIZE + 1):
+            self.flush_input()
+            self.programmer.writeln(self.OK.encode())
+            if len(self.programmer.readlines(21, self.timeout(63 * 21))) < 2:
+                break
+        self.flush_input()
+
+    def read_block_binary(self, addr, data_len, fd=None):
+        data = bytearray()
+        remaining_data_len = data_len
+        current_addr = addr
+        while remaining_data_len:
+            command_len = min(remaining_data_len, self.READ_COMMAND_SIZE)
+            self.isp_command("R %d %d" % (current_addr, command_len))
+
+            while command_len:
+                read_len = min(command_len, self.UU_BLOCK_SIZE)
+                cdata = self.programmer.read_bytes(read_len,
+                        self.timeout(read_len))
+                if len(cdata) < read_len:
+                    raise LinkError("Timeout reading data at 0x%x" %
+                            (current_addr + len(cdata)))
+                self.clean_block()
+                command_len -= read_len
+                remaining_data_len -= read_len
+
+                progress = (remaining_data_len / data_len) * 100
+                logger.info('Read %d bytes at 0x%-6x    (%3.0f%%)',
+                            read_len, current_addr, 100-progress)
+                current_addr += read_len
+
+                if fd:
+                    fd.write(cdata)
+                else:
+                    data += cdata
 
         if fd:
             return None
         else:
             return data
 
-    def write_ram_data(self, addr, data):
-        image_len = len(data)
-        for i in range(0, image_len, self.UU_BLOCK_SIZE):
-
-            a_block_size = image_len - i
-            if a_block_size > self.UU_BLOCK_SIZE:
-                a_block_size = self.UU_BLOCK_SIZE
+    def read_to_file(self, addr, data_len, filename):
+        # the dump goes straight to a memory mapped file of its final size,
+        # and the ranges saved so far are kept in a journal next to it, so
+        # that an interrupted read resumes where it stopped
+        if data_len <= 0 or data_len % 4:
+            logger.error("Data length must be a multiple of 4")
+            sys.exit(1)
+        # a journal left by a read of the same range of the same device
+        devsn = '-'.join('%08x' % x for x in self.get_devsn())
+        journal = RangeJournal(filename + '.journal',
+                'read %s %s 0x%x 0x%x' % (self.cpu.name, devsn, addr, data_len))
+        exists = os.path.exists(filename)
+        resume = journal.load()
+        if exists and not resume:
+            raise FileExistsError(filename)
+        # the ranges recorded went away with the dump
+        if resume and not exists:
+            logger.warning('%s is missing, reading it again', filename)
+            journal.remove()
+            resume = False
+
+        with open(filename, 'r+b' if exists else 'w+b') as fd:
+            fd.truncate(data_len)
+            dump = DumpWriter(mmap.mmap(fd.fileno(), data_len), journal,
+                    self.READ_JOURNAL_SIZE)
+            journal.open()
+            try:
+                missing = journal.missing(0, data_len)
+                if resume:
+                    logger.info('Resuming read, %d of %d bytes left',
+                            sum(e - s for s, e in missing), data_len)
+                for start, end in missing:
+                    dump.seek(start)
+                    self.read_block(addr + start, end - start, dump)
+            except BaseException:
+                logger.info('Read interrupted, run it again to resume')
+                raise
+            finally:
+                dump.close()
+                journal.close()
+        journal.remove()
 
-            err = self.write_ram_block(addr, data[i : i + a_block_size])
+    def write_ram_data(self, addr, data):
+        view = memoryview(data)
+        offset = 0
+        while offset < len(view):
+            size = self.transfer_size(len(view) - offset)
+            for attempt in range(self.RESEND_RETRIES + 1):
+                try:
+                    err = self.write_ram_block(addr + offset,
+                            view[offset:offset + size])
+                    break
+                except GarbledCommand:
+                    # the data may have gone elsewhere, it is written again
+                    if attempt == self.RESEND_RETRIES:
+                        raise
+                    self.retries += 1
             if err:
-                logger.error("Write error: %s", err)
-                sys.exit(1)
-
-            addr += a_block_size
-
-    def find_flash_sector(self, addr):
-        table = self.cpu.get_parameter("flash_sector")
-        flash_base_addr = self.cpu.get_parameter("flash_bank_addr", 0)
-
-        faddr = 0
-        if flash_base_addr:
-            faddr = flash_base_addr[0] # fix to have a current flash bank
-        for i in range(0, len(table)):
-            n_faddr = faddr + table[i] * 1024
-            if addr >= faddr and addr < n_faddr:
-                return i
-            faddr = n_faddr
-        return -1
+                raise LinkError("Write error: %s" % err)
+            offset += size
+
+    def sector_ranges(self, sectors):
+        # group consecutive sectors of a bank in (bank, start, end) ranges
+        ranges = []
+        for s in sorted(set(sectors)):
+            if ranges and ranges[-1][0] == s.bank and \
+                    ranges[-1][2] == s.sector - 1:
+                ranges[-1][2] = s.sector
+            else:
+                ranges.append([s.bank, s.sector, s.sector])
+        return [tuple(r) for r in ranges]
 
     def bytestr(self, ch, count):
-        data = b''
-        for i in range(0, count):
-            data += bytes([ch])
-        return data
+        return bytes((ch, )) * count
 
-    def insert_csum(self, orig_image):
+    def insert_csum(self, image, addr=None):
         # make this a valid image by inserting a checksum in the correct place
-        intvecs = struct.unpack("<8I", orig_image[0:32])
+        if not isinstance(image, FlashImage):
+            image = FlashImage(image)
 
         # default vector is 5: 0x14, new cortex cpus use 7: 0x1c
         valid_image_csum_vec = self.cpu.get_parameter("csum_vec", 5)
-        # calculate the checksum over the interrupt vectors
-        csum = 0
-        intvecs_list = []
-        for vec in range(0, len(intvecs)):
-            intvecs_list.append(intvecs[vec])
-            if valid_image_csum_vec == 5 or vec <= valid_image_csum_vec:
-                csum = csum + intvecs[vec]
-        # remove the value at the checksum location
-        csum -= intvecs[valid_image_csum_vec]
-
-        csum %= self.U32_MOD
-        csum = self.U32_MOD - csum
+        csum = image.insert_csum(valid_image_csum_vec, addr)
 
         logger.info("Inserting intvec checksum %08x in image at offset %d",
                 csum, valid_image_csum_vec)
 
-        intvecs_list[valid_image_csum_vec] = csum
-
-        image = b''
-        for vecval in intvecs_list:
-            image += struct.pack("<I", vecval)
-
-        image += orig_image[32:]
-
         return image
 
 
-    def prepare_flash_sectors(self, start_sector, end_sector):
+    def prepare_flash_sectors(self, start_sector, end_sector, bank=0):
         if self.sector_commands_need_bank:
-            self.isp_command("P %d %d 0" % (start_sector, end_sector))
+            cmd = "P %d %d %d" % (start_sector, end_sector, bank)
         else:
-            self.isp_command("P %d %d" % (start_sector, end_sector))
-
+            cmd = "P %d %d" % (start_sector, end_sector)
+        for attempt in range(self.RESEND_RETRIES + 1):
+            try:
+                self.isp_command(cmd, check_echo=True)
+                return
+            except GarbledCommand:
+                # preparing other sectors does no harm, the command is sent
+                # again
+                if attempt == self.RESEND_RETRIES:
+                    raise
+                self.retries += 1
 
-    def erase_sectors(self, start_sector, end_sector):
-        self.prepare_flash_sectors(start_sector, end_sector)
 
-        logger.info("Erasing flash sectors %d-%d", start_sector, end_sector)
+    def erase_sectors(self, start_sector, end_sector, bank=0):
+        self.prepare_flash_sectors(start_sector, end_sector, bank)
+        latency = (end_sector - start_sector + 1) * self.ERASE_TIME
 
         if self.sector_commands_need_bank:
-            self.isp_command("E %d %d 0" % (start_sector, end_sector))
+            logger.info("Erasing flash sectors %d-%d of bank %d",
+                    start_sector, end_sector, bank)
+            self.isp_command("E %d %d %d" % (start_sector, end_sector, bank),
+                    latency=latency)
         else:
-            self.isp_command("E %d %d" % (start_sector, end_sector))
+            logger.info("Erasing flash sectors %d-%d", start_sector, end_sector)
+            self.isp_command("E %d %d" % (start_sector, end_sector),
+                    latency=latency)
+
+    def find_flash_sectors(self, start_addr, end_addr):
+        # sectors covering [start_addr, end_addr)
+        sectors = self.cpu.sectors_in_range(start_addr, end_addr)
+        covered = start_addr
+        for sector in sectors:
+            if sector.start > covered:
+                break
+            covered = sector.start + sector.size
+        if covered < end_addr:
+            logger.error("Data at 0x%x-0x%x is outside of flash",
+                    start_addr, end_addr)
+            sys.exit(1)
+        return sectors
 
-    def erase_flash(self, start_addr, end_addr):
-        start_sector = self.find_flash_sector(start_addr)
-        end_sector = self.find_flash_sector(end_addr)
+    def flash_sectors(self, start_addr, end_addr):
+        # (bank, start, end) sector ranges covering [start_addr, end_addr)
+        return self.sector_ranges(self.find_flash_sectors(start_addr, end_addr))
 
-        self.erase_sectors(start_sector, end_sector)
+    def image_sectors(self, image, align):
+        # sectors holding data once the image is padded to align
+        sectors = []
+        for start, end in image.extents(align):
+            sectors.extend(self.find_flash_sectors(start, end))
+        return self.sector_ranges(sectors)
 
     def erase_all(self):
-        end_sector = self.cpu.get_parameter("flash_sector_count",
-            len(self.cpu.get_parameter("flash_sector"))) - 1
-
-        self.erase_sectors(0, end_sector)
-
-    def prog_image(self, image, flash_addr_base=None, erase_all=False):
-        self.read_serialnumber()
-
-        if flash_addr_base is None:
-            flash_addr_base = 0
-
-        # the base address of the ram block to be written to flash
-        ram_addr = self.cpu.get_parameter("flash_prog_buffer_base",
-                self.FLASH_BUFFER_BASE_DEFAULT)
-        # the size of the ram block to be written to flash
-        # 256 | 512 | 1024 | 4096
-        ram_block = self.cpu.get_parameter("flash_prog_buffer_size",
-                self.FLASH_BUFFER_SIZE_DEFAULT)
-
-        # if the image starts at the start of a flash bank then make it bootable
-        # by inserting a checksum at the right place in the vector table
-        if self.banks == 0 and flash_addr_base == 0:
-            image = self.insert_csum(image)
-        elif flash_addr_base in self.banks:
-            image = self.insert_csum(image)
-
-        image_len = len(image)
-        # pad to a multiple of ram_block size with 0xff
-        pad_count_rem = image_len % ram_block
-        if pad_count_rem != 0:
-            pad_count = ram_block - pad_count_rem
-            image += self.bytestr(0xff, pad_count)
-            image_len += pad_count
+        self.erase_sector_ranges(self.sector_ranges(self.cpu.flash_sectors))
+
+    def blank_check(self, start_sector, end_sector, bank=0):
+        # offset of the first non blank word from the start of start_sector,
+        # None if all the sectors are blank
+        if self.sector_commands_need_bank:
+            cmd = "I %d %d %d" % (start_sector, end_sector, bank)
+        else:
+            cmd = "I %d %d" % (start_sector, end_sector)
+        status = self.isp_command(cmd,
+                allowed=(self.CMD_SUCCESS, self.SECTOR_NOT_BLANK),
+                latency=(end_sector - start_sector + 1) * self.BLANK_CHECK_TIME)
+        if status == self.SECTOR_NOT_BLANK:
+            offset = int(self.programmer.readline())
+            # content of the non blank word
+            self.programmer.readline()
+            return offset
+        return None
+
+    def dirty_sectors(self, start_sector, end_sector, bank=0):
+        # one blank check per non blank sector found, plus the last one
+        sectors = [s for s in self.cpu.flash_sectors if s.bank == bank]
+        dirty = []
+        while start_sector <= end_sector:
+            offset = self.blank_check(start_sector, end_sector, bank)
+            if offset is None:
+                break
+            sector = self.cpu.find_sector(sectors[start_sector].start + offset)
+            dirty.append(sector)
+            start_sector = sector.sector + 1
+        return dirty
+
+    def erase_sector_ranges(self, ranges):
+        # sectors already blank are left out, the others are erased with as
+        # few prepare and erase commands as possible
+        dirty = []
+        count = 0
+        for bank, start_sector, end_sector in ranges:
+            dirty.extend(self.dirty_sectors(start_sector, end_sector, bank))
+            count += end_sector - start_sector + 1
+
+        if len(dirty) < count:
+            logger.info("%d of %d sectors already blank", count - len(dirty),
+                    count)
+
+        for bank, start_sector, end_sector in self.sector_ranges(dirty):
+            self.erase_sectors(start_sector, end_sector, bank)
+
+    def is_blank(self, data):
+        if len(self._blank) != len(data):
+            self._blank = self.bytestr(0xff, len(data))
+        return data == self._blank
+
+    def stage_blocks(self, blocks, slots, contiguous=False):
+        # split (address, block) pairs in lists fitting in the ram staging
+        # area, optionally made only of blocks adjacent in flash
+        stage = []
+        for flash_addr, block in blocks:
+            if stage and (len(stage) == slots or contiguous and
+                    stage[-1][0] + len(stage[-1][1]) != flash_addr):
+                yield stage
+                stage = []
+            stage.append((flash_addr, block))
+        if stage:
+            yield stage
+
+    def program_blocks(self, blocks, ram_addr, upload=True):
+        # the blocks are staged back to back in ram with a single upload,
+        # each one is then copied to its place in flash; a copy garbled on
+        # the way has the blocks not copied yet uploaded and copied again, so
+        # does a link failing mid stage once the baudrate is lowered; each
+        # stage starts unchecked
+        copied = set()
+        self.link_checked = False
+        for attempt in range(self.RESEND_RETRIES + 1):
+            try:
+                self.copy_blocks(blocks, ram_addr, upload, copied,
+                        attempt > 0)
+                break
+            except GarbledCommand as e:
+                if attempt == self.RESEND_RETRIES:
+                    raise
+                logger.warning('%s, copying the blocks again', e)
+                self.retries += 1
+                upload = True
+            except LinkError as e:
+                if not self.auto_baudrate or \
+                        attempt == self.RESEND_RETRIES or \
+                        not self.lower_baudrate():
+                    raise
+                logger.warning('%s, baudrate lowered to %d, copying the '
+                        'blocks again', e, self.baudrate)
+                upload = True
+
+        # the staged data is in flash, the ram can be used to check the link
+        self.check_link()
+
+    def copy_blocks(self, blocks, ram_addr, upload, copied, again=False):
+        if upload:
+            self.stage_data(ram_addr,
+                    b''.join(block for flash_addr, block in blocks))
+
+        for flash_addr, block in blocks:
+            # blocks are written to erased flash, which already reads as 0xff
+            if flash_addr not in copied and not self.is_blank(block):
+                # the garbled copy of the first block left may have gone
+                # through all the same
+                if not again or self.compare_flash(flash_addr, ram_addr,
+                        len(block)) is not None:
+                    self.copy_block(flash_addr, ram_addr, block)
+                again = False
+                copied.add(flash_addr)
+                if self.session:
+                    self.session.add(flash_addr, flash_addr + len(block))
+            ram_addr += len(block)
+
+    def stage_data(self, ram_addr, data):
+        # two errors in a UU block can cancel out in its checksum: data
+        # uploaded along with link errors is read back until it matches
+        for attempt in range(self.RESEND_RETRIES + 1):
+            self.write_ram_data(ram_addr, data)
+            if not self.link_checked:
+                return
+            # the echo tells garbled acknowledges of the read back data; a
+            # read garbled on the way fails like a staging that differs
+            self.check_commands()
+            try:
+                if self.read_block(ram_addr, len(data)) == data:
+                    return
+                logger.warning('Data staged at 0x%x differs, written again',
+                        ram_addr)
+            except LinkError as e:
+                logger.warning('%s, data staged at 0x%x written again', e,
+                        ram_addr)
+                self.abort_read()
+            self.link_error()
+            self.retries += 1
+        raise LinkError('Data staged at 0x%x keeps differing' % ram_addr)
+
+    def copy_block(self, flash_addr, ram_addr, block):
+        # sectors are protected again after each copy
+        for bank, s_flash_sector, e_flash_sector in \
+                self.flash_sectors(flash_addr, flash_addr + len(block)):
+            self.prepare_flash_sectors(s_flash_sector, e_flash_sector, bank)
+
+        # copy ram to flash
+        self.isp_command("C %d %d %d" % (flash_addr, ram_addr, len(block)),
+                latency=len(block) / 256 * self.COPY_TIME, check_echo=True)
+        # the ram still holds the block, the target checks the copy
+        if self.verify_writes or self.link_checked:
+            offset = self.compare_flash(flash_addr, ram_addr, len(block))
+            if offset is not None:
+                logger.error('Flash differs from the image at 0x%x',
+                        flash_addr + offset)
+                sys.exit(1)
+
+    def open_session(self, image, devsn):
+        # the session is keyed by the device serial number and the image,
+        # the chip and the block size: a journal left by an interrupted
+        # session of the same image on the same device is resumed
+        digest = hashlib.sha1(self.cpu.name.encode())
+        digest.update(b'%d' % self.cpu.ram_buffer.block_size)
+        for addr, data in image.segments:
+            digest.update(b'%d %d' % (addr, len(data)))
+            digest.update(data)
+
+        os.makedirs(self.session_dir, exist_ok=True)
+        self.session = RangeJournal(os.path.join(self.session_dir,
+                '%s.journal' % '-'.join('%08x' % x for x in devsn)),
+                'prog %s' % digest.hexdigest())
+        resume = self.session.load()
+        self.session.open()
+        return resume
+
+    def session_matches(self, image, ram_addr, ram_block):
+        # checked cheaply before the erase is skipped: the last block
+        # journaled as copied is compared with the flash, the blocks left
+        # must still be blank, with a blank check of the sectors holding no
+        # journaled block and a compare with 0xff for the others
+        done = []
+        left = []
+        for flash_addr, block in image.blocks(ram_block):
+            if self.is_blank(block):
+                continue
+            if self.session.done(flash_addr, flash_addr + len(block)):
+                done.append((flash_addr, block))
+            else:
+                left.append((flash_addr, block))
+
+        if done:
+            flash_addr, block = done[-1]
+            self.write_ram_data(ram_addr, block)
+            if self.compare_flash(flash_addr, ram_addr, len(block)) \
+                    is not None:
+                return False
+
+        written = set(self.cpu.find_sector(flash_addr)
+                for flash_addr, block in done)
+        sectors = [self.cpu.find_sector(flash_addr)
+                for flash_addr, block in left]
+        for bank, start_sector, end_sector in self.sector_ranges(
+                [s for s in sectors if s not in written]):
+            if self.blank_check(start_sector, end_sector, bank) is not None:
+                return False
+
+        staged = False
+        for flash_addr, block in left:
+            if self.cpu.find_sector(flash_addr) not in written:
+                continue
+            if not staged:
+                self.write_ram_data(ram_addr, b'\xff' * ram_block)
+                staged = True
+            if self.compare_flash(flash_addr, ram_addr, len(block)) \
+                    is not None:
+                return False
+        return True
+
+    def prog_image(self, image, flash_addr_base=None, erase_all=False,
+            incremental=False):
+        devsn = self.read_serialnumber()
+
+        if not isinstance(image, FlashImage):
+            image = FlashImage(image, flash_addr_base or 0)
+
+        # the base address and size of the ram block to be written to flash
+        # (256 | 512 | 1024 | 4096), and the ram available to stage blocks
+        ram_addr, ram_block, ram_size = self.cpu.ram_buffer
+        # the number of ram blocks staged in ram before being copied
+        slots = max(ram_size // ram_block, 1)
+
+        # the image is split across the flash banks: each part that starts at
+        # the start of its bank is made bootable by inserting a checksum at
+        # the right place in the vector table
+        for bank_addr in self.banks:
+            if image.find_segment(bank_addr, 32):
+                self.insert_csum(image, bank_addr)
+
+        # only the ram_block sized blocks holding data are written, gaps
+        # between them are neither erased nor programmed
+        image_len = image.padded_size(ram_block)
+        pad_count = image_len - len(image)
 
         logger.info("Padding with %d bytes" % pad_count)
 
-        if erase_all:
+        if incremental:
+            self.prog_image_incremental(image, ram_addr, ram_block, slots)
+            return
+
+        resume = self.session_dir is not None and \
+                self.open_session(image, devsn)
+        # the flash may have been written or erased since the session was
+        # interrupted
+        if resume and not self.session_matches(image, ram_addr, ram_block):
+            logger.warning('Flash differs from the interrupted session, '
+                    'starting over')
+            self.session.remove()
+            self.session.open()
+            resume = False
+        try:
+            self.prog_image_blocks(image, ram_addr, ram_block, slots,
+                    image_len, erase_all, resume)
+        finally:
+            if self.session:
+                self.session.close()
+
+        # the session is over, its journal is of no use anymore
+        if self.session:
+            self.session.remove()
+            self.session = None
+
+    def prog_image_blocks(self, image, ram_addr, ram_block, slots, image_len,
+            erase_all=False, resume=False):
+        # the sectors were erased by the interrupted session, the blocks it
+        # copied to flash are left as they are
+        if resume:
+            logger.info('Resuming the interrupted session, erase skipped')
+        elif erase_all:
             self.erase_all()
         else:
-            self.erase_flash(flash_addr_base, flash_addr_base + image_len)
-
-        for image_index in range(0, image_len, ram_block):
-            a_ram_block = image_len - image_index
-            if a_ram_block > ram_block:
-                a_ram_block = ram_block
+            self.erase_sector_ranges(self.image_sectors(image, ram_block))
+
+        banks = {}
+        blank_count = 0
+        done_count = 0
+        for flash_addr, block in image.blocks(ram_block):
+            if self.is_blank(block):
+                blank_count += 1
+                continue
+            if resume and self.session.done(flash_addr,
+                    flash_addr + len(block)):
+                done_count += 1
+                continue
+            bank = self.cpu.find_sector(flash_addr).bank
+            banks.setdefault(bank, []).append((flash_addr, block))
+
+        if blank_count:
+            logger.info('Skipping %d blank blocks', blank_count)
+        if done_count:
+            logger.info('Skipping %d blocks already written', done_count)
+
+        image_len -= (blank_count + done_count) * ram_block
+        image_index_stop = 0
+        for bank, blocks in sorted(banks.items()):
+            if self.sector_commands_need_bank:
+                logger.info("Programming flash bank %d at 0x%x",
+                        bank, self.banks[bank])
+
+            for stage in self.stage_blocks(blocks, slots):
+                self.program_blocks(stage, ram_addr)
+
+                a_ram_block = len(stage) * ram_block
+                image_index_stop += a_ram_block
+                left_KB = (image_len - image_index_stop) / 1024
+                written_KB = a_ram_block/1024
+                progress = (image_index_stop / image_len) * 100
+                logger.info('Writted %dKB to 0x%-6x    %3dKB left (%3.0f%%)',
+                        written_KB, stage[0][0], left_KB, progress)
 
-            flash_addr_start = image_index + flash_addr_base
-            flash_addr_end = flash_addr_start + a_ram_block
-            image_index_stop = (image_index + a_ram_block)
+        logger.info('Image written to flash')
 
+    def prog_image_incremental(self, image, ram_addr, ram_block, slots=1):
+        # group the blocks by the sector holding them, the ram block is never
+        # larger than the smallest sector
+        sectors = []
+        for flash_addr, block in image.blocks(ram_block):
+            self.find_flash_sectors(flash_addr, flash_addr + len(block))
+            sector = self.cpu.find_sector(flash_addr)
+            if not sectors or sectors[-1][0] != sector:
+                sectors.append((sector, []))
+            sectors[-1][1].append((flash_addr, block))
+
+        skipped = 0
+        for sector, blocks in sectors:
+            # the boot rom may remap the vector table of a bank while in ISP
+            # mode, so the sector holding it is always rewritten
+            changed = sector.start in self.banks
+            in_ram = []
+            if not changed:
+                for stage in self.stage_blocks(blocks, slots, True):
+                    self.write_ram_data(ram_addr,
+                            b''.join(block for flash_addr, block in stage))
+                    if self.compare(stage[0][0], ram_addr,
+                            len(stage) * ram_block) is not None:
+                        changed, in_ram = True, stage
+                        break
+
+            if not changed:
+                logger.info('Sector %d at 0x%x unchanged, skipped',
+                        sector.sector, sector.start)
+                skipped += 1
+                continue
+
+            self.erase_sectors(sector.sector, sector.sector, sector.bank)
+
+            # the erase leaves the ram untouched: the different blocks are
+            # copied before being overwritten by the next upload
+            if in_ram:
+                self.program_blocks(in_ram, ram_addr, upload=False)
+            staged = set(flash_addr for flash_addr, block in in_ram)
+            blocks = [(flash_addr, block) for flash_addr, block in blocks
+                    if flash_addr not in staged and not self.is_blank(block)]
+            for stage in self.stage_blocks(blocks, slots):
+                self.program_blocks(stage, ram_addr)
+
+            logger.info('Sector %d at 0x%x written', sector.sector,
+                    sector.start)
+
+        logger.info('Image written to flash, %d of %d sectors unchanged',
+                skipped, len(sectors))
+
+    def verify_image(self, image, flash_addr_base=None):
+        # the image is uploaded to ram and compared with the flash by the
+        # target, returns the (start, end) ranges of the blocks that differ,
+        # each one starting at its first difference
+        if not isinstance(image, FlashImage):
+            image = FlashImage(image, flash_addr_base or 0)
+
+        ram_addr, ram_block, ram_size = self.cpu.ram_buffer
+        slots = max(ram_size // ram_block, 1)
+
+        # the flash holds the image made bootable by prog_image
+        for bank_addr in self.banks:
+            if image.find_segment(bank_addr, 32):
+                self.insert_csum(image, bank_addr)
+
+        mismatches = []
+        image_len = image.padded_size(ram_block)
+        verified = 0
+        for stage in self.stage_blocks(image.blocks(ram_block), slots, True):
             self.write_ram_data(ram_addr,
-                    image[image_index: image_index + a_ram_block])
-
-            s_flash_sector = self.find_flash_sector(flash_addr_start)
-
-            e_flash_sector = self.find_flash_sector(flash_addr_end)
-
-            self.prepare_flash_sectors(s_flash_sector, e_flash_sector)
-
-            # copy ram to flash
-            self.isp_command("C %d %d %d" %
-                    (flash_addr_start, ram_addr, a_ram_block))
+                    b''.join(block for flash_addr, block in stage))
+
+            # after a difference, the comparison goes on with the next block
+            flash_addr = stage[0][0]
+            size = len(stage) * ram_block
+            pos = 0
+            while pos < size:
+                offset = self.compare_flash(flash_addr + pos, ram_addr + pos,
+                        size - pos)
+                if offset is None:
+                    break
+                block_pos = (pos + offset) // ram_block * ram_block
+                start = flash_addr + pos + offset
+                pos = block_pos + ram_block
+                # differences in adjacent blocks make a single range
+                if mismatches and mismatches[-1][1] == flash_addr + block_pos:
+                    mismatches[-1] = (mismatches[-1][0], flash_addr + pos)
+                else:
+                    mismatches.append((start, flash_addr + pos))
 
-            left_KB = (image_len - image_index_stop) / 1024
-            written_KB = a_ram_block/1024
-            progress = (image_index_stop / image_len) * 100
-            logger.info('Writted %dKB to 0x%-6x    %3dKB left (%3.0f%%)',
-                    written_KB, flash_addr_start, left_KB, progress)
+            verified += size
+            logger.info('Verified %dKB at 0x%-6x    (%3.0f%%)', size / 1024,
+                    flash_addr, verified / image_len * 100)
 
-        logger.info('Image written to flash')
+        return mismatches
 
     def start(self, addr=None):
         addr = addr or 0
@@ -463,32 +1480,44 @@ class NXPprog(object):
     def select_bank(self, bank):
         status = self.isp_command("S %d" % bank)
 
-        if status == self.OK:
+        if status == 0:
             return 1
 
         return 0
 
     def get_devid(self):
         self.isp_command("J")
-        id1 = self.programmer.readline()
-
-        # FIXME find a way of doing this without a timeout
-        id2 = self.programmer.readline(.2)
-        if id2:
-            ret = (int(id1), int(id2))
+        words = [int(self.programmer.readline())]
+
+        # the reply length is known from the first word of the chips in the
+        # table, otherwise the words are read until the link goes quiet
+        count = NXPchip.devid_words_for(words[0])
+        if count is None:
+            while True:
+                word = self.programmer.readline(self.timeout(self.REPLY_SIZE))
+                if not word:
+                    break
+                words.append(int(word))
         else:
-            ret = int(id1)
-        return ret
+            for i in range(count - 1):
+                words.append(int(self.programmer.readline()))
+
+        if len(words) == 1:
+            return words[0]
+        return tuple(words)
 
     def get_devsn(self):
         self.isp_command("N")
         ret = list()
         for i in range(4):
-            ret.append(int(self.programmer.readline(.2), 0))
+            ret.append(int(self.programmer.readline(
+                self.timeout(self.REPLY_SIZE)), 0))
 
         return ret
 
     def finalize(self):
+        if self.retries:
+            logger.info('%d blocks had to be sent again', self.retries)
         self.programmer.post_prog()
 
     def readline(self, *args, **kwargs):
@@ -523,11 +1552,25 @@ if __name__ == "__main__":
             help='Select bank for devices with flash banks')
     actions_group.add_argument('--read-serialnumber', '-S', action='store_true',
             help='Read serialnumber from connected device')
+    actions_group.add_argument('--verify', '-V', action='store_true',
+            help='Don\'t program, compare the flash with the image')
 
     parser.add_argument('--cpu', '-c', metavar='CPU', choices=list(NXPchip.CPUS.keys()), default=None,
             help='Specify chip')
-    parser.add_argument('--baudrate', '-b', metavar='BAUD', type=int, choices=NXPprog.BAUDRATES, default=115200,
-            help='Specify baudrate for communication')
+    def baudrate(value):
+        if value == 'auto':
+            return value
+        try:
+            value = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid baudrate: {!r}'.format(value))
+        if value not in NXPprog.BAUDRATES:
+            raise argparse.ArgumentTypeError('baudrate must be auto or one of {}'.format(
+                ', '.join(str(b) for b in NXPprog.BAUDRATES)))
+        return value
+
+    parser.add_argument('--baudrate', '-b', metavar='BAUD', type=baudrate, default=115200,
+            help='Specify baudrate for communication, auto picks the fastest stable one')
     parser.add_argument('--oscfreq', type=int, default=16000,
             help='OSC Freq')
     parser.add_argument('--xonxoff', action='store_true',
@@ -536,10 +1579,18 @@ if __name__ == "__main__":
             help='Use RTS and DTR to control reset and int0')
     parser.add_argument('--addr', '-a', type=str, default="0",
             help='Set the base address for the image')
-    parser.add_argument('--filetype', choices=('ihex', 'bin'), default='bin',
-            help='Set filetype to Intel hex or raw binary')
+    parser.add_argument('--filetype', choices=('ihex', 'bin', 'elf', 'srec'),
+            default='bin',
+            help='Set filetype to Intel hex, raw binary, ELF or Motorola S-record')
     parser.add_argument('--eraseall', '-E', action='store_true',
             help='Erase all the flash, not just the area written to')
+    parser.add_argument('--incremental', '-i', action='store_true',
+            help='Only rewrite the sectors whose content differs from the image')
+    parser.add_argument('--verify-writes', action='store_true',
+            help='Compare each block with the flash right after writing it')
+    parser.add_argument('--session-dir', metavar='DIR', default=None,
+            help='Keep a journal of the programming session in DIR, so that an '
+            'interrupted session resumes without erasing again')
     parser.add_argument('--length', '-L', type=str, default="1",
             help='Specify the length to read (only usefull with --read)')
     parser.add_argument('--console', action='store_true',
@@ -560,14 +1611,21 @@ if __name__ == "__main__":
 
         parser.exit(0)
 
-    if not (args.eraseonly or args.start or args.selectbank or
+    if not (args.eraseonly or args.start or args.selectbank is not None or
             args.read_serialnumber) \
             and not args.image_file:
         parser.error('argument IMAGE_FILE is required in this mode')
         parser.exit(1)
 
+    if args.incremental and args.eraseall:
+        parser.error('--incremental cannot be used with --eraseall')
+
     prog = NXPprog(**vars(args))
-    prog.init_programmer()
+    try:
+        prog.init_programmer()
+    except LinkError as e:
+        logger.error('Link error: %s', e)
+        sys.exit(1)
 
     logger.info("Initializing with cpu=%s oscfreq=%d baud=%d",
                 prog.cpu.name, prog.oscfreq, prog.baudrate)
@@ -583,26 +1641,20 @@ if __name__ == "__main__":
             prog.erase_all()
         elif args.start is not None:
             prog.start()
-        elif args.selectbank:
+        elif args.selectbank is not None:
             prog.select_bank(args.selectbank)
         elif args.read_serialnumber:
             prog.read_serialnumber()
         elif args.read:
             if not args.image_file:
                 parser.exit(1)
-            output_file = Path(args.image_file)
-            if output_file.exists():
+            logger.info("Reading %d bytes starting at 0x%-6x", args.length, args.addr)
+            try:
+                prog.read_to_file(args.addr, args.length, args.image_file)
+            except FileExistsError:
                 logger.error("File already exists")
                 parser.exit(1)
-
-            logger.info("Reading %d bytes starting at 0x%-6x", args.length, args.addr)
-            with open(args.image_file, "wb") as fd:
-                data = prog.read_block(args.addr, args.length)
-                if data:
-                    fd.write(data)
-                    logger.info("Data saved in %s", args.image_file)
-                else:
-                    logger.warn("No data could be read")
+            logger.info("Data saved in %s", args.image_file)
         else:
             if not args.image_file:
                 parser.exit(1)
@@ -613,16 +1665,42 @@ if __name__ == "__main__":
                 logger.error("File does not exist")
                 parser.exit(1)
 
-            if args.filetype == "ihex":
-                ih = ihex.ihex(filename)
-                (args.addr, image) = ih.flatten()
-            else:
-                with open(filename, "rb") as f:
-                    image = f.read()
+            # a malformed file or overlapping records
+            try:
+                if args.filetype == "ihex":
+                    ih = ihex.ihex(filename)
+                    image = FlashImage.from_segments(
+                            (d.addr, d.data) for d in ih.data)
+                    args.addr = image.base_addr
+                elif args.filetype == "elf":
+                    image = elf.load(filename)
+                    args.addr = image.base_addr
+                elif args.filetype == "srec":
+                    image = srec.load(filename)
+                    args.addr = image.base_addr
+                else:
+                    image = FlashImage.from_file(filename, args.addr)
+            except (ihex.IhexError, elf.ElfError, srec.SrecError,
+                    ValueError) as e:
+                logger.error("Invalid image file: %s", e)
+                parser.exit(1)
 
-            prog.prog_image(image, args.addr, args.eraseall)
+            if args.verify:
+                mismatches = prog.verify_image(image, args.addr)
+                for start, end in mismatches:
+                    logger.error("Flash differs from the image at 0x%x-0x%x",
+                            start, end)
+                if mismatches:
+                    sys.exit(1)
+                logger.info("Flash matches the image")
+            else:
+                prog.prog_image(image, args.addr, args.eraseall,
+                        args.incremental)
 
-            prog.start(args.addr)
+                prog.start(args.addr)
+    except LinkError as e:
+        logger.error('Link error: %s', e)
+        sys.exit(1)
     finally:
         prog.finalize()
 
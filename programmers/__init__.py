@@ -13,10 +13,12 @@
 from .abstract import ProgrammerError
 from .buspirate import BusPirate
 from .serial import SerialProgrammer
+from .simulator import SimulatorProgrammer
 
 programmers = {
         'serial': SerialProgrammer,
         'buspirate': BusPirate,
+        'simulator': SimulatorProgrammer,
         }
 
 def find_programmer(name):
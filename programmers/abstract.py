@@ -10,9 +10,17 @@
 
 """
 
+import time
+
+
 class AbstractProgrammer(object):
+    # largest read done at once when the incoming data size is unknown
+    READ_CHUNK_SIZE = 4096
+
     def __init__(self, *args, **kwargs):
-        self.data_buffer = b''
+        self.data_buffer = bytearray()
+        # data_buffer[:_scan_pos] is known to hold no line end
+        self._scan_pos = 0
 
     def init_device(self):
         raise NotImplementedError()
@@ -32,19 +40,40 @@ class AbstractProgrammer(object):
     def write(self, data):
         raise NotImplementedError()
 
+    def set_baudrate(self, baudrate):
+        raise ProgrammerError('Baudrate cannot be changed with {}'.format(
+            self.__class__.__name__))
+
     def data_available(self):
         return self.in_waiting
 
-    def readline(self, timeout=None, strip_end=True):
-        line = b''
-        while 1:
-            self.data_buffer += self.read(self.in_waiting or 1, timeout=timeout)
-            if not self.data_buffer:
-                break
-
-            line = self.find_line()
-            if line:
-                break
+    def clear_buffer(self):
+        del self.data_buffer[:]
+        self._scan_pos = 0
+
+    def _deadline(self, timeout):
+        if timeout is None:
+            timeout = getattr(self, 'timeout', None)
+        if timeout is None:
+            return None
+        return time.monotonic() + timeout
+
+    def _fill_buffer(self, deadline, timeout, size=1):
+        # waits for the size bytes known to be on their way, at least one,
+        # then takes everything already received; an empty read means the
+        # deadline has passed. Each read is given the timeout of the whole
+        # call rather than the time left, so that the port is not
+        # reconfigured on every read: the last one may end a bit late.
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        size = min(max(self.in_waiting, size, 1), self.READ_CHUNK_SIZE)
+        data = self.read(size, timeout=timeout)
+        if not data:
+            return False
+        self.data_buffer += data
+        return True
+
+    def _decode_line(self, line, strip_end):
         try:
             if strip_end:
                 line = line.rstrip(b'\r\n')
@@ -52,12 +81,59 @@ class AbstractProgrammer(object):
         except UnicodeDecodeError:
             return line
 
+    def readline(self, timeout=None, strip_end=True):
+        line = self.find_line()
+        if line is None:
+            deadline = self._deadline(timeout)
+            while line is None and self._fill_buffer(deadline, timeout):
+                line = self.find_line()
+        return self._decode_line(line or b'', strip_end)
+
+    def readlines(self, count, timeout=None, strip_end=True, size=0):
+        """
+        Read count lines within timeout, fewer if it expires first.
+
+        size is the number of bytes the lines are known to hold at least,
+        so that they are received in as few reads as possible.
+        """
+        lines = []
+        deadline = self._deadline(timeout)
+        while len(lines) < count:
+            line = self.find_line()
+            if line is None:
+                if not self._fill_buffer(deadline, timeout,
+                        size - len(self.data_buffer)):
+                    break
+                continue
+            size -= len(line)
+            lines.append(self._decode_line(line, strip_end))
+        return lines
+
+    def read_bytes(self, size, timeout=None):
+        # raw data, possibly already buffered by readline
+        deadline = self._deadline(timeout)
+        while len(self.data_buffer) < size:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            data = self.read(size - len(self.data_buffer), timeout=timeout)
+            if not data:
+                break
+            self.data_buffer += data
+        data = bytes(self.data_buffer[:size])
+        del self.data_buffer[:size]
+        self._scan_pos = 0
+        return data
+
     def find_line(self):
-        pos = self.data_buffer.find(b'\n')
-        if pos >= 0:
-            line, self.data_buffer = self.data_buffer[:pos+1], \
-                self.data_buffer[pos+1:]
-            return line
+        # only the data received since the last call is scanned
+        pos = self.data_buffer.find(b'\n', self._scan_pos)
+        if pos < 0:
+            self._scan_pos = len(self.data_buffer)
+            return None
+        line = bytes(self.data_buffer[:pos + 1])
+        del self.data_buffer[:pos + 1]
+        self._scan_pos = 0
+        return line
 
     def writeline(self, data, **kwargs):
         return self.write(data + b'\n', **kwargs)
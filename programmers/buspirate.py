@@ -142,6 +142,10 @@ class BusPirate(SerialProgrammer):
             self.logger.warn('Bridge mode active. Unplug/plug your'
                     ' BusPirate to reset it.')
 
+    def set_baudrate(self, baudrate):
+        # the serial port talks to the BusPirate, not to the target
+        raise ProgrammerError('Baudrate cannot be changed through the BusPirate')
+
     def set_aux_pin(self, state):
         if not self._set_pinstate(self.UART_AUX_PIN, state):
             raise ProgrammerError('Error while setting AUX pin')
@@ -172,17 +176,11 @@ class BusPirate(SerialProgrammer):
 
 
     def read(self, size=None, timeout=None):
-        if timeout:
-            ot = self._serial.timeout
-            self._serial.timeout = timeout
-
+        self._set_port_timeout(timeout)
         data = self._serial.read(size or self._serial.in_waiting)
         if not self.bridge_mode:
             self.logger.debug('RAW', data, len(data))
 
-        if timeout:
-            self._serial.timeout = ot
-
         return data
 
     def write(self, data, **kwargs):
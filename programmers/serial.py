@@ -10,6 +10,7 @@
 
 """
 
+import math
 import serial
 import time
 import logging
@@ -46,34 +47,51 @@ class SerialProgrammer(AbstractProgrammer):
         self.logger.warn('Please reset the board manually.')
 
     def read(self, size=None, timeout=None):
-        if timeout:
-            ot = self._serial.timeout
+        self._set_port_timeout(timeout)
+        return self._serial.read(size or self._serial.in_waiting)
+
+    def _set_port_timeout(self, timeout):
+        # reconfiguring the port costs system calls, and control transfers
+        # on USB adapters: it is only done when the timeout changes, and
+        # timeouts are rounded up to 10ms so that close values are shared.
+        # Reads without a timeout of their own keep a longer one in place.
+        if timeout is None:
+            current = self._serial.timeout
+            if self._timeout is not None and current is not None and \
+                    current >= self._timeout:
+                return
+            timeout = self._timeout
+        elif timeout:
+            timeout = math.ceil(timeout * 100) / 100
+        if timeout != self._serial.timeout:
             self._serial.timeout = timeout
 
-        data = self._serial.read(size or self._serial.in_waiting)
-
-        if timeout:
-            self._serial.timeout = ot
-
-        return data
-
     def write(self, data, **kwargs):
         return self._serial.write(data)
 
+    def set_baudrate(self, baudrate):
+        if self._serial:
+            try:
+                self._serial.baudrate = baudrate
+            except (serial.SerialException, ValueError) as e:
+                # the port is left at the baudrate it had
+                self._serial.baudrate = self.baudrate
+                raise ProgrammerError('Cannot set {} baud: {}'.format(
+                    baudrate, e))
+        self.baudrate = baudrate
+
     @property
     def in_waiting(self):
         return self._serial.in_waiting
 
     @property
     def timeout(self):
-        if self._serial:
-            return self._serial.timeout
+        # default timeout, reads may be given their own
         return self._timeout
 
     @timeout.setter
     def timeout(self, timeout):
+        self._timeout = timeout
         if self._serial:
-            self._serial.timeout = timeout
+            self._set_port_timeout(timeout)
             self.logger.info('Timeout set to {}s'.format(timeout))
-        else:
-            self._timeout = timeout
@@ -0,0 +1,617 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2026 NXP-flasher contributors
+#
+# Distributed under terms of the MIT license.
+
+"""
+In-process LPC ISP bootloader used in place of a real target.
+
+The device name given on the command line selects the simulated chip, with
+optional comma separated settings, e.g. ``lpc1768,turnaround=0.002``.
+"""
+
+import binascii
+import logging
+import math
+import random
+import time
+from collections import defaultdict
+
+from nxpchips import NXPchip
+
+from .abstract import AbstractProgrammer
+from .abstract import ProgrammerError
+
+
+class SimulatedTarget(object):
+    CMD_SUCCESS = 0
+    INVALID_COMMAND = 1
+    SRC_ADDR_ERROR = 2
+    DST_ADDR_ERROR = 3
+    SRC_ADDR_NOT_MAPPED = 4
+    DST_ADDR_NOT_MAPPED = 5
+    COUNT_ERROR = 6
+    INVALID_SECTOR = 7
+    SECTOR_NOT_BLANK = 8
+    SECTOR_NOT_PREPARED_FOR_WRITE_OPERATION = 9
+    COMPARE_ERROR = 10
+    BUSY = 11
+    PARAM_ERROR = 12
+    ADDR_ERROR = 13
+    ADDR_NOT_MAPPED = 14
+    CMD_LOCKED = 15
+    INVALID_CODE = 16
+    INVALID_BAUD_RATE = 17
+    INVALID_STOP_BIT = 18
+
+    UNLOCK_CODE = 23130
+    UU_LINE_SIZE = 45
+    UU_BLOCK_LINES = 20
+    COPY_SIZES = (256, 512, 1024, 4096)
+    BAUDRATES = (9600, 19200, 38400, 57600, 115200, 230400, 460800, 921600)
+
+    RAM_SIZE_DEFAULT = 0x8000
+
+    # Timing model, in seconds. The target never sleeps: time is accounted
+    # in `stats` so that runs are fast but still comparable. The host time
+    # spent inside the simulator itself is reported as `cpu_time`.
+    SETTINGS = {
+            'turnaround': 0.001,    # USB-serial latency paid by every write
+            'erase_time': 0.1,      # per sector
+            'copy_time': 0.001,     # per 256 bytes programmed
+            'max_baudrate': 0,      # fastest error free baudrate, 0 for any
+            'error_rate': 0.0001,   # per byte corruption above max_baudrate
+            'fill': 0xff,           # flash contents at power up, blank by default
+            'seed': 0,
+            }
+
+    def __init__(self, cpu, baudrate, **settings):
+        self.cpu = NXPchip(cpu)
+        self.baudrate = baudrate
+        # baudrate of the host side of the link
+        self.link_baudrate = baudrate
+        self.settings = dict(self.SETTINGS)
+        for key, value in settings.items():
+            if key not in self.settings:
+                raise ProgrammerError('Unknown simulator setting: {}'.format(key))
+            self.settings[key] = type(self.SETTINGS[key])(value)
+
+        self.need_bank = bool(self.cpu.get_parameter('flash_bank_addr', 0))
+        self.banks = self.cpu.flash_banks
+        self.bank_size = self.cpu.flash_bank_size
+        self.sectors = [s for s in self.cpu.flash_sectors if s.bank == 0]
+        self.flash = [bytearray(bytes((self.settings['fill'], )) * self.bank_size)
+                for b in self.banks]
+
+        self.binary = bool(self.cpu.get_parameter('isp_binary', False))
+        self.ram_base = self.cpu.ram_buffer.base
+        self.ram = bytearray(max(self.RAM_SIZE_DEFAULT,
+                self.cpu.ram_buffer.size))
+
+        seed = self.settings['seed']
+        self._random = random.Random(seed)
+        self.serial_number = tuple((0x5a5a0000 + seed * 4 + i) & 0xffffffff
+                for i in range(4))
+
+        self.stats = {
+                'cpu_time': 0.0,
+                'bytes_in': 0,
+                'bytes_out': 0,
+                'writes': 0,
+                'commands': defaultdict(int),
+                'time': defaultdict(float),
+                }
+
+        self.echo = True
+        self.unlocked = False
+        self.prepared = set()
+        self.running = None
+        self.state = 'autobaud'
+        self._inbuf = bytearray()
+        self._outbuf = bytearray()
+        self._phase = 'sync'
+        self._pending = 0.0
+        self._xfer = None
+
+    # Wire side
+
+    def receive(self, data):
+        started = time.perf_counter()
+        try:
+            self._receive(data)
+        finally:
+            self.stats['cpu_time'] += time.perf_counter() - started
+
+    def _receive(self, data):
+        self.stats['bytes_in'] += len(data)
+        self.stats['writes'] += 1
+        self._pending += len(data) * 10 / self.baudrate \
+                + self.settings['turnaround']
+
+        if self.running is not None:
+            return
+
+        self._inbuf += self._corrupt(data)
+        if self.state == 'autobaud':
+            pos = self._inbuf.find(b'?')
+            if pos < 0:
+                del self._inbuf[:]
+                return
+            del self._inbuf[:pos + 1]
+            self._send_line('Synchronized')
+            self.state = 'sync'
+
+        while self.running is None:
+            if self.state == 'write_binary':
+                if not self._receive_binary():
+                    break
+                continue
+            pos = self._inbuf.find(b'\n')
+            if pos < 0:
+                break
+            line = bytes(self._inbuf[:pos]).rstrip(b'\r')
+            del self._inbuf[:pos + 1]
+            self._line(line)
+
+        self._account(0)
+
+    def _receive_binary(self):
+        xfer = self._xfer
+        size = min(len(self._inbuf), xfer['remaining'])
+        if not size:
+            return False
+        self._store(xfer['addr'], self._inbuf[:size])
+        del self._inbuf[:size]
+        xfer['addr'] += size
+        xfer['remaining'] -= size
+        if not xfer['remaining']:
+            self._xfer = None
+            self.state = 'command'
+        return True
+
+    def transmit(self, size=None):
+        started = time.perf_counter()
+        if size is None or size > len(self._outbuf):
+            size = len(self._outbuf)
+        data = bytes(self._outbuf[:size])
+        del self._outbuf[:size]
+        self.stats['cpu_time'] += time.perf_counter() - started
+        return data
+
+    @property
+    def pending(self):
+        return len(self._outbuf)
+
+    def _send(self, data):
+        self.stats['bytes_out'] += len(data)
+        self._account(len(data) * 10 / self.baudrate)
+        self._outbuf += self._corrupt(data)
+
+    def _corrupt(self, data):
+        # flip bits of random bytes, leaving line ends alone
+        if self.link_baudrate != self.baudrate:
+            rate = 0.5
+        elif self.settings['max_baudrate'] and \
+                self.baudrate > self.settings['max_baudrate']:
+            rate = self.settings['error_rate']
+        else:
+            return data
+        if rate <= 0:
+            return data
+
+        data = bytearray(data)
+        index = -1
+        while True:
+            # distance to the next error is geometrically distributed
+            index += 1 + int(math.log(1.0 - self._random.random()) /
+                    math.log(1.0 - rate))
+            if index >= len(data):
+                break
+            if data[index] not in b'\r\n':
+                data[index] ^= 0x04
+        return data
+
+    def _send_line(self, line):
+        self._send(str(line).encode() + b'\r\n')
+
+    def _account(self, duration):
+        # wire time of received data is only known once the line is parsed
+        duration += self._pending
+        self._pending = 0.0
+        self.stats['time'][self._phase] += duration
+
+    def _echo(self, line):
+        if self.echo:
+            self._send(line + b'\r\n')
+
+    # Protocol states
+
+    def _line(self, line):
+        handler = getattr(self, '_state_' + self.state)
+        handler(line)
+
+    def _state_sync(self, line):
+        self._echo(line)
+        if line == b'Synchronized':
+            self._send_line('OK')
+            self.state = 'osc'
+        else:
+            self.state = 'autobaud'
+
+    def _state_osc(self, line):
+        self._echo(line)
+        try:
+            int(line)
+        except ValueError:
+            self.state = 'autobaud'
+            return
+        self._send_line('OK')
+        self.state = 'command'
+
+    def _state_command(self, line):
+        if not line.strip():
+            return
+        self._echo(line)
+
+        cmd, *params = line.decode(errors='replace').split()
+        if cmd != 'G':
+            try:
+                params = [int(p) for p in params]
+            except ValueError:
+                self._send_line(self.PARAM_ERROR)
+                return
+
+        self.stats['commands'][cmd] += 1
+        if cmd in ('A', 'U', 'J', 'N'):
+            self._phase = 'sync'
+        else:
+            self._phase = cmd
+        # sectors are prepared for the next erase or copy: charge them the
+        # time of the prepare command
+        time_spent = self.stats['time']
+        if cmd != 'P' and 'P' in time_spent:
+            time_spent[self._phase] += time_spent.pop('P')
+        self._account(0)
+
+        handler = getattr(self, '_cmd_' + cmd, None)
+        if handler is None:
+            self._send_line(self.INVALID_COMMAND)
+            return
+        try:
+            status = handler(*params)
+        except TypeError:
+            status = self.PARAM_ERROR
+        if status is not None:
+            self._send_line(status)
+
+    def _state_write_data(self, line):
+        if not line:
+            return
+        self._echo(line)
+        xfer = self._xfer
+        try:
+            xfer['block'] += binascii.a2b_uu(line)
+        except binascii.Error:
+            xfer['corrupted'] = True
+        xfer['lines'] += 1
+        if xfer['lines'] >= self.UU_BLOCK_LINES or \
+                len(xfer['block']) >= xfer['remaining']:
+            self.state = 'write_checksum'
+
+    def _state_write_checksum(self, line):
+        self._echo(line)
+        xfer = self._xfer
+        block = xfer['block'][:xfer['remaining']]
+        try:
+            csum = int(line)
+        except ValueError:
+            csum = None
+        if xfer.get('corrupted') or csum != sum(block):
+            self._send_line('RESEND')
+        else:
+            self._store(xfer['addr'], block)
+            xfer['addr'] += len(block)
+            xfer['remaining'] -= len(block)
+            self._send_line('OK')
+
+        xfer['block'] = bytearray()
+        xfer['lines'] = 0
+        xfer.pop('corrupted', None)
+        if xfer['remaining'] > 0:
+            self.state = 'write_data'
+        else:
+            self._xfer = None
+            self.state = 'command'
+
+    def _state_read_ack(self, line):
+        if not line:
+            return
+        self._echo(line)
+        xfer = self._xfer
+        if line == b'OK':
+            xfer['addr'] += xfer['sent']
+            xfer['remaining'] -= xfer['sent']
+        if xfer['remaining'] > 0:
+            self._send_read_block()
+        else:
+            self._xfer = None
+            self.state = 'command'
+
+    def _send_read_block(self):
+        xfer = self._xfer
+        size = min(xfer['remaining'], self.UU_LINE_SIZE * self.UU_BLOCK_LINES)
+        data = self._load(xfer['addr'], size)
+        for i in range(0, size, self.UU_LINE_SIZE):
+            self._send(binascii.b2a_uu(data[i:i + self.UU_LINE_SIZE])[:-1] + b'\r\n')
+        self._send_line(sum(data))
+        xfer['sent'] = size
+        self.state = 'read_ack'
+
+    # Memory map
+
+    def _locate(self, addr, count):
+        """Return (buffer, offset) of a mapped range, or None."""
+        for bank, base in enumerate(self.banks):
+            if base <= addr and addr + count <= base + self.bank_size:
+                return self.flash[bank], addr - base
+        if self.ram_base <= addr and \
+                addr + count <= self.ram_base + len(self.ram):
+            return self.ram, addr - self.ram_base
+        return None
+
+    def _is_ram(self, addr, count):
+        loc = self._locate(addr, count)
+        return loc is not None and loc[0] is self.ram
+
+    def _load(self, addr, count):
+        buf, offset = self._locate(addr, count)
+        return bytes(buf[offset:offset + count])
+
+    def _store(self, addr, data):
+        buf, offset = self._locate(addr, len(data))
+        buf[offset:offset + len(data)] = data
+
+    def _flash_sectors(self, addr, count):
+        """Return (bank, first sector, last sector) of a flash range."""
+        sectors = self.cpu.sectors_in_range(addr, addr + count)
+        if not sectors or sectors[0].bank != sectors[-1].bank or \
+                sectors[0].start > addr or \
+                sectors[-1].start + sectors[-1].size < addr + count:
+            return None
+        return sectors[0].bank, sectors[0].sector, sectors[-1].sector
+
+    def _sector_args(self, start, end, bank):
+        if bank is None:
+            if self.need_bank:
+                return None
+            bank = 0
+        if bank >= len(self.banks):
+            return None
+        if start > end or end >= len(self.sectors):
+            return None
+        return bank
+
+    # Commands
+
+    def _cmd_U(self, code):
+        if code != self.UNLOCK_CODE:
+            return self.INVALID_CODE
+        self.unlocked = True
+        return self.CMD_SUCCESS
+
+    def _cmd_A(self, setting):
+        if setting not in (0, 1):
+            return self.PARAM_ERROR
+        self._send_line(self.CMD_SUCCESS)
+        self.echo = bool(setting)
+
+    def _cmd_J(self):
+        self._send_line(self.CMD_SUCCESS)
+        for word in self.cpu.devid or (0, ):
+            self._send_line(word)
+
+    def _cmd_N(self):
+        self._send_line(self.CMD_SUCCESS)
+        for word in self.serial_number:
+            self._send_line(word)
+
+    def _cmd_W(self, addr, count):
+        if addr % 4:
+            return self.DST_ADDR_ERROR
+        if count % 4:
+            return self.COUNT_ERROR
+        if not self._is_ram(addr, count):
+            return self.DST_ADDR_NOT_MAPPED
+        self._send_line(self.CMD_SUCCESS)
+        if count and self.binary:
+            self._xfer = {'addr': addr, 'remaining': count}
+            self.state = 'write_binary'
+        elif count:
+            self._xfer = {'addr': addr, 'remaining': count,
+                    'block': bytearray(), 'lines': 0}
+            self.state = 'write_data'
+
+    def _cmd_R(self, addr, count):
+        if addr % 4:
+            return self.SRC_ADDR_ERROR
+        if count % 4:
+            return self.COUNT_ERROR
+        if self._locate(addr, count) is None:
+            return self.SRC_ADDR_NOT_MAPPED
+        self._send_line(self.CMD_SUCCESS)
+        if count and self.binary:
+            self._send(self._load(addr, count))
+        elif count:
+            self._xfer = {'addr': addr, 'remaining': count}
+            self._send_read_block()
+
+    def _cmd_P(self, start, end, bank=None):
+        bank = self._sector_args(start, end, bank)
+        if bank is None:
+            return self.INVALID_SECTOR
+        for sector in range(start, end + 1):
+            self.prepared.add((bank, sector))
+        return self.CMD_SUCCESS
+
+    def _cmd_E(self, start, end, bank=None):
+        if not self.unlocked:
+            return self.CMD_LOCKED
+        bank = self._sector_args(start, end, bank)
+        if bank is None:
+            return self.INVALID_SECTOR
+        for sector in range(start, end + 1):
+            if (bank, sector) not in self.prepared:
+                return self.SECTOR_NOT_PREPARED_FOR_WRITE_OPERATION
+        for sector in self.sectors[start:end + 1]:
+            offset = sector.start - self.banks[0]
+            self.flash[bank][offset:offset + sector.size] = b'\xff' * sector.size
+        self.prepared.clear()
+        self._account((end - start + 1) * self.settings['erase_time'])
+        return self.CMD_SUCCESS
+
+    def _cmd_I(self, start, end, bank=None):
+        bank = self._sector_args(start, end, bank)
+        if bank is None:
+            return self.INVALID_SECTOR
+        first = self.sectors[start].start - self.banks[0]
+        last = self.sectors[end].start + self.sectors[end].size - self.banks[0]
+        data = bytes(self.flash[bank][first:last])
+        offset = len(data) - len(data.lstrip(b'\xff'))
+        if offset == len(data):
+            return self.CMD_SUCCESS
+        offset -= offset % 4
+        self._send_line(self.SECTOR_NOT_BLANK)
+        self._send_line(offset)
+        self._send_line(int.from_bytes(data[offset:offset + 4], 'little'))
+
+    def _cmd_C(self, flash_addr, ram_addr, count):
+        if not self.unlocked:
+            return self.CMD_LOCKED
+        if flash_addr % 256:
+            return self.DST_ADDR_ERROR
+        if ram_addr % 4:
+            return self.SRC_ADDR_ERROR
+        if count not in self.COPY_SIZES:
+            return self.COUNT_ERROR
+        sectors = self._flash_sectors(flash_addr, count)
+        if sectors is None:
+            return self.DST_ADDR_NOT_MAPPED
+        if not self._is_ram(ram_addr, count):
+            return self.SRC_ADDR_NOT_MAPPED
+        bank, first, last = sectors
+        for sector in range(first, last + 1):
+            if (bank, sector) not in self.prepared:
+                return self.SECTOR_NOT_PREPARED_FOR_WRITE_OPERATION
+
+        # flash cells can only be programmed from 1 to 0
+        buf, offset = self._locate(flash_addr, count)
+        data = self._load(ram_addr, count)
+        current = int.from_bytes(buf[offset:offset + count], 'little')
+        programmed = current & int.from_bytes(data, 'little')
+        buf[offset:offset + count] = programmed.to_bytes(count, 'little')
+
+        self.prepared.clear()
+        self._account(count / 256 * self.settings['copy_time'])
+        return self.CMD_SUCCESS
+
+    def _cmd_M(self, addr1, addr2, count):
+        if addr1 % 4:
+            return self.SRC_ADDR_ERROR
+        if addr2 % 4:
+            return self.DST_ADDR_ERROR
+        if count % 4:
+            return self.COUNT_ERROR
+        if self._locate(addr1, count) is None:
+            return self.SRC_ADDR_NOT_MAPPED
+        if self._locate(addr2, count) is None:
+            return self.DST_ADDR_NOT_MAPPED
+        data1 = self._load(addr1, count)
+        data2 = self._load(addr2, count)
+        if data1 == data2:
+            return self.CMD_SUCCESS
+        offset = next(i for i in range(0, count, 4)
+                if data1[i:i + 4] != data2[i:i + 4])
+        self._send_line(self.COMPARE_ERROR)
+        self._send_line(offset)
+
+    def _cmd_G(self, addr, mode):
+        if not self.unlocked:
+            return self.CMD_LOCKED
+        if mode not in ('A', 'T'):
+            return self.PARAM_ERROR
+        try:
+            addr = int(addr)
+        except ValueError:
+            return self.PARAM_ERROR
+        self._send_line(self.CMD_SUCCESS)
+        self.running = addr
+
+    def _cmd_B(self, baudrate, stop_bits):
+        if baudrate not in self.BAUDRATES:
+            return self.INVALID_BAUD_RATE
+        if stop_bits not in (1, 2):
+            return self.INVALID_STOP_BIT
+        # the reply is sent at the previous baudrate
+        self._send_line(self.CMD_SUCCESS)
+        self.baudrate = baudrate
+
+    def _cmd_S(self, bank):
+        if not self.need_bank or bank >= len(self.banks):
+            return self.PARAM_ERROR
+        self.active_bank = bank
+        return self.CMD_SUCCESS
+
+
+class SimulatorProgrammer(AbstractProgrammer):
+    def __init__(self, device, baudrate, *args, **kwargs):
+        self.logger = logging.getLogger('NXPprog.%s' % (self.__class__.__name__))
+        super().__init__(self, *args, **kwargs)
+        self.device, self.baudrate = device, baudrate
+        self.target = None
+        self._timeout = 1
+
+    def init_device(self):
+        if self.target is not None:
+            raise ProgrammerError('SimulatorProgrammer is already started.')
+
+        name, *options = self.device.split(',')
+        settings = {}
+        for option in options:
+            key, _, value = option.partition('=')
+            settings[key.strip()] = value.strip()
+
+        try:
+            self.target = SimulatedTarget(name.lower(), self.baudrate, **settings)
+        except ValueError as e:
+            raise ProgrammerError(str(e))
+
+        self.logger.info('Simulating {}'.format(name.upper()))
+
+    def enter_isp_mode(self):
+        pass
+
+    def read(self, size=None, timeout=None):
+        return self.target.transmit(size)
+
+    def write(self, data, **kwargs):
+        self.target.receive(bytes(data))
+        return len(data)
+
+    def set_baudrate(self, baudrate):
+        self.baudrate = baudrate
+        self.target.link_baudrate = baudrate
+
+    @property
+    def in_waiting(self):
+        return self.target.pending
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._timeout = timeout
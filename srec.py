@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2026 NXP-flasher contributors
+#
+# Distributed under terms of the MIT license.
+
+"""
+Loads Motorola S-record files
+"""
+
+from image import FlashImage
+
+
+class SrecError(Exception):
+    pass
+
+
+# address length of the data records
+DATA_RECORDS = {'S1': 2, 'S2': 3, 'S3': 4}
+# address length of the start address records
+START_RECORDS = {'S7': 4, 'S8': 3, 'S9': 2}
+
+
+def load(filename=None, fd=None):
+    """Return a FlashImage, adjacent records being merged in segments."""
+    if filename:
+        with open(filename, 'r') as fd:
+            return parse(fd)
+    return parse(fd)
+
+
+def parse(lines):
+    image = FlashImage()
+    seg_addr = None
+    seg_data = None
+
+    line_no = 0
+    for line in lines:
+        line_no += 1
+        l = line.strip()
+        if not l:
+            continue
+        if l[0] != 'S' or len(l) < 4:
+            raise SrecError('invalid record start %r: line %d' % (l[:2],
+                line_no))
+
+        rtype = l[:2]
+        try:
+            rec = bytes.fromhex(l[2:])
+        except ValueError:
+            raise SrecError('invalid hex digits or odd length: line %d' %
+                    line_no) from None
+        if rec[0] != len(rec) - 1:
+            raise SrecError('data length does not match count field: line %d' %
+                    line_no)
+        if sum(rec) & 0xff != 0xff:
+            raise SrecError('invalid checksum: line %d' % line_no)
+
+        if rtype in DATA_RECORDS:
+            addr_len = DATA_RECORDS[rtype]
+            addr = int.from_bytes(rec[1:1 + addr_len], 'big')
+            data = memoryview(rec)[1 + addr_len:-1]
+            if seg_data is not None and addr == seg_addr + len(seg_data):
+                seg_data += data
+            else:
+                if seg_data is not None:
+                    add_segment(image, seg_addr, seg_data, line_no)
+                seg_addr, seg_data = addr, bytearray(data)
+        elif rtype in START_RECORDS:
+            break
+        elif rtype not in ('S0', 'S5', 'S6'):
+            raise SrecError('unknown record type %s: line %d' % (rtype,
+                line_no))
+
+    if seg_data is not None:
+        add_segment(image, seg_addr, seg_data, line_no)
+
+    return image
+
+
+def add_segment(image, addr, data, line_no):
+    try:
+        image.add_segment(addr, data)
+    except ValueError as e:
+        raise SrecError('%s: line %d' % (e, line_no)) from None